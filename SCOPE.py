@@ -1,15 +1,310 @@
+import io
+import os
+import atexit
+import mmap
+import sys
+import shutil
+import itertools
+import hashlib
+import zipfile
+import multiprocessing
 import numpy as np
-from datetime import datetime
-from astropy.table import Table as t, vstack, hstack, join
-from astropy.coordinates import SkyCoord as sc, EarthLocation as el, AltAz as aa, get_sun
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import astropy
+from astropy.table import Table as t, Column, MaskedColumn, vstack, hstack, join
+from astropy.io import ascii
+from astropy.coordinates import SkyCoord as sc, EarthLocation as el, AltAz as aa, CIRS, TETE, get_sun, get_body
+from astropy.coordinates.erfa_astrom import erfa_astrom
 from astropy.time import Time
 from astropy import units as u
+from astropy.utils import iers
+from astropy.utils.data import conf as dataconf
 import matplotlib.pyplot as plt
 
+try:
+  import astropy_iers_data                                                      # Separate IERS data package (astropy >= 6.0), used to version the caches
+except ImportError:
+  astropy_iers_data=None
+
+try:
+  import resource                                                               # Unix only, used to report the peak memory of long conversions
+except ImportError:
+  resource=None
+
+# Directory holding the local caches of SCOPE, which can be relocated using the SCOPE_CACHE_DIR environment variable
+CACHE_DIR=os.environ.get('SCOPE_CACHE_DIR',os.path.join(os.path.expanduser('~'),'.scope_cache'))
+EPHEMERIS_CACHE_BYTES=8*1024**2                                                 # Disk budget of the Sun ephemeris cache (least recently used entries are evicted)
+VISIBILITY_CACHE_BYTES=256*1024**2                                              # Disk budget of the visibility result cache (windows and altitude grids)
+CHECKPOINT_ROWS=50000                                                           # Rows per checkpointed block of a visibility window run (resumed if interrupted)
+
+MJD_DESCRIPTION='MJD (UTC)'                                                     # Description marking float64 time columns, shown as ISO dates only for display
+GALACTIC_MATRIX=None                                                            # ICRS to Galactic rotation matrix, derived from astropy on first use
+SCRATCH_FILES=set()                                                             # Files backing the altitude grids of this session, removed when it ends
+SEASON_STARS=None                                                               # RA and Dec (degrees) of the season planner's stars, inherited by its forked workers
+CONVERSION_CHUNK=500000                                                         # Rows per block of the chunked coordinate conversions (options 1a-1f)
+OCCUPANCY_GROUPS=10                                                             # Most curves drawn by the Targets Up vs Time plot (the smaller groups are summed as 'Other')
+CSV_BLOCK_ROWS=200000                                                           # Rows per block of the streaming .csv reader
+STREAMING_BYTES=2*1024**3                                                       # .csv catalogs larger than this (in bytes) are offered the streaming mode
+SIDECAR_SUFFIX='.scope'                                                         # Suffix of the binary sidecar folder written next to a parsed .csv catalog
+NULL_SAMPLE_ROWS=10                                                             # Most rows with NULL or empty values displayed after loading a catalog
+
+# Local IERS snapshot (Earth orientation table in the IERS-A finals format and leap-second table), replaced with: python SCOPE.py --refresh-iers <file>
+IERS_DIR=os.path.join(CACHE_DIR,'iers')
+IERS_EOP_FILE=os.path.join(IERS_DIR,'finals2000A.all')
+IERS_LEAP_FILE=os.path.join(IERS_DIR,'Leap_Second.dat')
+IERS_TAG='bundled'                                                              # Identity of the loaded snapshot, part of the cache version
+
+###################################################################################################################################################################
+
+# Creating a function which loads the IERS snapshot once for the session, with every network access of astropy disabled
+# The local snapshot is used where present and the tables bundled with astropy otherwise; times beyond the Earth orientation table
+# are converted with degraded accuracy (and a warning) instead of triggering a download
+# Returns a short description of the loaded tables
+def load_iers_snapshot():
+  global IERS_TAG
+  iers.conf.auto_download=False
+  iers.conf.auto_max_age=None
+  iers.conf.iers_degraded_accuracy='warn'
+  dataconf.allow_internet=False
+
+  eopfile=IERS_EOP_FILE if os.path.isfile(IERS_EOP_FILE) else iers.IERS_A_FILE
+  leapfile=IERS_LEAP_FILE if os.path.isfile(IERS_LEAP_FILE) else iers.IERS_LEAP_SECOND_FILE
+
+  eop=iers.IERS_A.open(eopfile)
+  iers.earth_orientation_table.set(eop)
+  leap=iers.LeapSeconds.open(leapfile)
+  leap.update_erfa_leap_seconds()
+
+  tags=[]
+  for path in (eopfile,leapfile):
+    if path in (IERS_EOP_FILE,IERS_LEAP_FILE):
+      info=os.stat(path)
+      tags.append(f"{info.st_size}-{int(info.st_mtime)}")
+    else:
+      tags.append('bundled')
+  IERS_TAG='bundled' if tags==['bundled','bundled'] else hashlib.sha1('|'.join(tags).encode()).hexdigest()[:12]
+
+  Time('2000-01-01',scale='utc').ut1                                            # Priming the leap-second and UT1-UTC lookups so that the first transform has no setup cost
+
+  source='local snapshot' if eopfile==IERS_EOP_FILE else 'bundled with astropy'
+  return (f"Earth orientation table ({source}) covering {Time(eop['MJD'][0].value,format='mjd').iso[:10]} to "
+          f"{Time(eop['MJD'][-1].value,format='mjd').iso[:10]}; leap seconds valid until {leap.expires.iso[:10]}.")
+
+# Creating a function which replaces the local IERS snapshot with a local file, either an IERS-A finals file (e.g., finals2000A.all)
+# or a leap-second file (IERS Leap_Second.dat or IETF leap-seconds.list); the file is validated before the snapshot is replaced
+def refresh_iers_snapshot(path):
+  try:
+    iers.IERS_A.read(path)
+    target=IERS_EOP_FILE
+  except Exception:
+    try:
+      iers.LeapSeconds.open(path)
+      target=IERS_LEAP_FILE
+    except Exception:
+      raise ValueError(f"The file {path} is neither an IERS-A finals file nor a leap-second file !!!") from None
+
+  os.makedirs(IERS_DIR,exist_ok=True)
+  tmp=target+f'.{os.getpid()}.tmp'
+  shutil.copyfile(path,tmp)
+  os.replace(tmp,target)                                                        # Atomic replacement, a running session never sees a partial file
+  return target
+
 ###################################################################################################################################################################
 
+# Creating a function which returns the column names of a .csv catalog, read from its header line only
+def csv_header(fname):
+  with open(fname) as f:
+    header=f.readline()
+  return ascii.read(header,format='csv',guess=False).colnames if header.strip() else []
+
+# Creating a generator which reads a .csv catalog in blocks of rows (as tables), so that a catalog larger than memory is never held whole
+# The schema (column names and types) is fixed by the header and the first blocks, and the later blocks are cast to the same types: an integer
+# column is widened to float from the first block holding non-integer numbers, a column empty so far takes the type of the first block with values,
+# and a ValueError is raised for text in a numeric column; quoted fields must not contain line breaks
+# Only the given columns (names) are converted when names is not None
+def csv_blocks(fname,rows=CSV_BLOCK_ROWS,names=None):
+  with open(fname) as f:
+    header=f.readline()
+    schema=None
+    first=1                                                                     # Line number (0 is the header) of the first row of the block
+    while True:
+      lines=list(itertools.islice(f,rows))
+      if not lines:
+        return
+      block=ascii.read(header+''.join(lines),format='csv',guess=False,include_names=names)
+      if schema is None:
+        schema={name:None for name in block.colnames}                           # None until a block holds values in the column
+      elif block.colnames!=list(schema):
+        raise ValueError(f"The block starting at line {first} of {fname} does not have the columns of the header !!!")
+      for name,dtype in schema.items():
+        col=block[name]
+        if isinstance(col,MaskedColumn) and col.mask.all():                     # No values in this block: any type fits
+          if dtype is not None and col.dtype!=dtype:
+            block[name]=col.astype(dtype if dtype.kind!='U' else str)
+          continue
+        if dtype is None or (dtype.kind in 'iu' and col.dtype.kind=='f'):
+          schema[name]=col.dtype if col.dtype.kind!='U' else np.dtype(str)
+          continue
+        if dtype.kind in 'iuf' and col.dtype.kind not in 'iuf':
+          raise ValueError(f"The column {name} holds numbers in the earlier blocks but text in the block starting at line {first} of {fname} !!!")
+        if col.dtype.kind!=dtype.kind or (dtype.kind!='U' and col.dtype!=dtype):
+          block[name]=col.astype(dtype if dtype.kind!='U' else str)
+      first+=len(lines)
+      yield block
+
+###################################################################################################################################################################
+
+# Creating a function which checks whether a column still reads its values from a memory-mapped file
+def memmapped(col):
+  base=getattr(col,'base',None)
+  while base is not None:
+    if isinstance(base,(mmap.mmap,np.memmap)):
+      return True
+    base=getattr(base,'base',None)
+  return False
+
+# Creating a table class for the memory-mapped .fits catalogs: nothing is read when the file is opened, and a column is copied into
+# memory (in the native byte order) the first time it is accessed by name, later accesses using the copy; the other columns stay on disk
+class LazyTable(t):
+
+  _lazy=frozenset()                                                             # Names of the columns still read from the file
+
+  # Wraps a table whose columns are (partly) memory-mapped, without reading them
+  @classmethod
+  def wrap(cls,table):
+    table=cls(table,copy=False)
+    table._lazy={name for name in table.colnames if memmapped(table.columns[name])}
+    for name in table._lazy:
+      table.columns[name].setflags(write=False)                                 # In-place updates (e.g., sorting) then replace the column instead
+    return table
+
+  @classmethod
+  def open(cls,fname):
+    return cls.wrap(t.read(fname,format='fits',memmap=True))
+
+  def __getitem__(self,item):
+    if isinstance(item,str) and item in self._lazy:
+      self._lazy.discard(item)
+      col=super().__getitem__(item)
+      if memmapped(col):
+        self.replace_column(item,col.copy(data=col.data.astype(col.dtype.newbyteorder('='))))
+    return super().__getitem__(item)
+
+  # Copies share the (read-only) columns that are still on disk, so that copying the catalog does not read it whole
+  def copy(self,copy_data=True):
+    out=super().copy(copy_data=False)
+    out._lazy={name for name in out.colnames if memmapped(out.columns[name])}
+    if copy_data:
+      for name in out.colnames:
+        if name not in out._lazy:
+          out.replace_column(name,out.columns[name].copy())
+    return out
+
+  # Reads every column still on disk (e.g., before the file is overwritten)
+  def materialize(self):
+    for name in list(self._lazy):
+      self[name]
+    return self
+
+###################################################################################################################################################################
+
+# Creating a function which returns the SHA-1 hash of a file, read in blocks
+def file_hash(fname,block=16*1024**2):
+  digest=hashlib.sha1()
+  with open(fname,'rb') as f:
+    for data in iter(lambda: f.read(block),b''):
+      digest.update(data)
+  return digest.hexdigest()
+
+# Creating a function which returns the identity of a .csv catalog (size, modification time and hash) and of the parser, which a sidecar must match
+def sidecar_source(fname):
+  stat=os.stat(fname)
+  return np.array([str(stat.st_size),str(stat.st_mtime_ns),file_hash(fname),f"v1-numpy{np.__version__}-astropy{astropy.__version__}"])
+
+# Creating a function which loads a .csv catalog from its binary sidecar (a folder of .npy files next to it, written by sidecar_store)
+# The columns are memory-mapped and only read when first used (see LazyTable); None is returned if the sidecar is missing, unreadable
+# or does not match the catalog (which is then parsed again)
+def sidecar_load(fname):
+  folder=fname+SIDECAR_SUFFIX
+  stat=os.stat(fname)                                                           # Raises FileNotFoundError for a missing catalog
+  try:
+    with np.load(os.path.join(folder,'source.npz')) as meta:
+      source,names,masked=meta['source'],[str(name) for name in meta['names']],meta['masked']
+    if source[0]!=str(stat.st_size) or source[1]!=str(stat.st_mtime_ns) or not np.array_equal(source,sidecar_source(fname)):
+      return None
+    cols=[]
+    for k,name in enumerate(names):
+      data=np.load(os.path.join(folder,f"col{k:04d}.npy"),mmap_mode='r')
+      if masked[k]:
+        cols.append(MaskedColumn(data,name=name,mask=np.load(os.path.join(folder,f"col{k:04d}.mask.npy"),mmap_mode='r'),copy=False))
+      else:
+        cols.append(Column(data,name=name,copy=False))
+  except (OSError,ValueError,KeyError,zipfile.BadZipFile):                      # Missing, unreadable or corrupted (e.g., truncated) sidecar
+    return None
+  return LazyTable.wrap(t(cols,copy=False))
+
+# Creating a function which writes the binary sidecar of a parsed .csv catalog: one .npy file per column (and mask), plus the identity of the catalog
+# A sidecar that cannot be written (e.g., read-only folder or full disk) is skipped; returns whether it was written
+def sidecar_store(fname,table):
+  folder=fname+SIDECAR_SUFFIX
+  tmp=folder+'.tmp'
+  try:
+    shutil.rmtree(tmp,ignore_errors=True)
+    os.makedirs(tmp)
+    masked=[]
+    for k,name in enumerate(table.colnames):
+      col=table.columns[name]
+      np.save(os.path.join(tmp,f"col{k:04d}.npy"),np.ma.getdata(col))
+      masked.append(isinstance(col,MaskedColumn))
+      if masked[-1]:
+        np.save(os.path.join(tmp,f"col{k:04d}.mask.npy"),np.ma.getmaskarray(col))
+    np.savez(os.path.join(tmp,'source.npz'),source=sidecar_source(fname),names=np.array(table.colnames),masked=np.array(masked))
+    shutil.rmtree(folder,ignore_errors=True)
+    os.replace(tmp,folder)                                                      # Renaming ensures that a half-written sidecar is never loaded
+  except OSError:
+    shutil.rmtree(tmp,ignore_errors=True)
+    return False
+  return True
+
+###################################################################################################################################################################
+
+# Creating a function which finds the NULL values of a table: masked entries (e.g., empty fields of a .csv file) in any column, and empty or
+# whitespace-only strings in the text columns; each column is checked as a whole, in blocks of rows, without reading the columns still on disk into memory
+# Returns the number of NULL values of each column (as a dictionary) and a boolean array flagging the rows with at least one NULL value
+def null_scan(table,chunk=CONVERSION_CHUNK):
+  counts={}
+  nullrows=np.zeros(len(table),dtype=bool)
+  for name in table.colnames:
+    col=table.columns[name]
+    if not isinstance(col,MaskedColumn) and col.dtype.kind not in 'US':
+      continue
+    colnull=np.ma.getmaskarray(col).copy()
+    if col.dtype.kind in 'US':
+      data=np.ma.getdata(col)
+      for start in range(0,len(data),chunk):
+        colnull[start:start+chunk]|=np.char.strip(data[start:start+chunk])==data.dtype.type()
+    colnull=colnull.reshape(len(col),-1).any(axis=1)                            # A row of a vector column is null if any of its values is
+    counts[name]=int(colnull.sum())
+    nullrows|=colnull
+  return {name:n for name,n in counts.items() if n>0},nullrows
+
+###################################################################################################################################################################
+
+# Refreshing the local IERS snapshot from local files (python SCOPE.py --refresh-iers <file> [<file>]) instead of starting a session
+if len(sys.argv)>2 and sys.argv[1]=='--refresh-iers':
+  for path in sys.argv[2:]:
+    try:
+      print(f"The IERS snapshot file {refresh_iers_snapshot(path)} has been REFRESHED from {path}.")
+    except (OSError,ValueError) as err:
+      print(f"ERROR: {err}")
+  exit()
+
 print(":::::::::::::::::::::::::  WELCOME TO SCOPE (Stellar Catalog & Observation Planning Engine) !!!  :::::::::::::::::::::::::",end='\n\n')
 
+# Loading the IERS snapshot once for the session (no network access), so that the AltAz dependent options have a predictable latency
+print("IERS data: "+load_iers_snapshot(),end='\n\n')
+
 # Asking user to enter the name of the file consisting of the star catalog
 fname=input("Enter the name of the file (in .csv / .fits) consisting of the star catalog: ")
 print('\n')
@@ -27,15 +322,59 @@ if (fname.lower().endswith('.csv'))==True:
 else:
   fmt='fits'
 
-# Ensuring that the file provided by the user exists
+# Offering the streaming mode for .csv catalogs too large to be loaded whole: only the first block is then loaded, for the schema and display
+streaming=False
+if fmt=='csv' and os.path.isfile(fname) and os.path.getsize(fname)>STREAMING_BYTES:
+  print("NOTE: LARGE CATALOG",end='\n\n')
+  print('*************************************************************************************************************************************************',end='\n\n')
+  print(f"> The file {fname} is {os.path.getsize(fname)/1024**3:.1f} GB, which may not fit in memory once loaded as a table.")
+  print(f"> In STREAMING MODE the catalog is read in blocks of {CSV_BLOCK_ROWS} rows: filters, derived quantities and coordinate conversions")
+  print("  are applied block by block and written to a new .csv file, without ever holding the whole table.")
+  print("> The other menus of SCOPE need the whole table and are NOT available in streaming mode.",end='\n\n')
+  print('*************************************************************************************************************************************************',end='\n\n')
+  chsm=input("If you want to use the STREAMING MODE, type (y / Y / yes / YES): ")
+  print('\n')
+  streaming=chsm in ['y','Y','yes','YES']
+
+# Ensuring that the file provided by the user exists, and reading its column names (a .fits catalog is opened memory-mapped, without reading the columns)
 try:
-  readtable=t.read(fname,format=fmt)
+  if fmt=='fits':
+    readtable=LazyTable.open(fname)
+    colnames=readtable.colnames
+  else:
+    colnames=csv_header(fname)
 except FileNotFoundError:
   print(f"ERROR: File {fname} not found !!! Please check the name and try again !!!")
   print("Your session has been TERMINATED !!!",end='\n\n')
   print('*************************************************************************************************************************************************',end='\n\n')
   exit()
 
+# Asking user for the columns needed in this session, so that the other columns of the catalog are neither parsed nor held in memory
+# The names are asked again until they are all columns of the catalog
+while True:
+  chcols=input("Enter the names of the columns needed in this session, separated by commas (press Enter to load all the columns): ")
+  print('\n')
+  usecols=[name.strip() for name in chcols.split(',') if name.strip()] or None  # None loads all the columns
+  missing=[name for name in usecols or [] if name not in colnames]
+  if not missing:
+    break
+  print(f"ERROR: The columns {', '.join(missing)} are not in {fname} !!! Column names are case-sensitive !!!",end='\n\n')
+  print(f"The columns of {fname} are: {', '.join(colnames)}",end='\n\n')
+
+# Loading the catalog (only the columns needed)
+if streaming:
+  readtable=next(csv_blocks(fname,names=usecols),t())
+elif fmt=='csv':
+  readtable=sidecar_load(fname)                                                 # Binary sidecar of an earlier session, if it still matches the catalog
+  if readtable is None:
+    readtable=t.read(fname,format=fmt,include_names=usecols)
+    if usecols is None and sidecar_store(fname,readtable):                      # A sidecar always holds all the columns
+      print(f"NOTE: A binary copy of the catalog has been saved in {fname+SIDECAR_SUFFIX}, so that later sessions load it without parsing.",end='\n\n')
+  else:
+    print(f"NOTE: The catalog has been loaded from its binary copy in {fname+SIDECAR_SUFFIX} (unchanged since it was parsed).",end='\n\n')
+if usecols is not None:
+  readtable.keep_columns([name for name in readtable.colnames if name in usecols])
+
 # Ensuring that the table in the file provided is non-empty
 try:
   if len(readtable)==0:
@@ -48,28 +387,28 @@ except ValueError:
 
 # Ensuring that the user is made aware of any NULL or empty string entries present in string-type columns
 
-nullinx,nullrow=[],[]                        # Lists to store indices and rows containing nulls
-
-# Scanning the entire table for NULL or EMPTY string values
-for index,row in enumerate(readtable):
-  for val in row:
-    if isinstance(val,(str)) and val.strip()=='':
-      nullinx.append(index)                  # Store row index
-      nullrow.append(row)                    # Store full row contents
-      break                                  # Stop checking further in the same row once a null is found
+nullcounts,nullrows=null_scan(readtable)      # NULL values of each column, and the rows containing them
+nullinx=np.flatnonzero(nullrows)
 
 # If null or empty string values are detected, displaying a structured warning and guiding the user
 if len(nullinx)!=0:
   print("*** NULL OR EMPTY STRING VALUES DETECTED IN THE LOADED TABLE ***", end='\n\n')
-  print("> One or more rows contain EMPTY entries in string-type columns (e.g., '', ' ', or multiple spaces).")
+  print("> One or more rows contain EMPTY entries (missing values, or strings such as '', ' ', or multiple spaces).")
   print("> These may affect operations like sorting, filtering, or plotting, and etc, if those columns are involved.", end='\n\n')
   print('*************************************************************************************************************************************************',end='\n\n')
 
-  # Displaying all rows with detected nulls, along with their row indices, for user reference
-  print("The following row(s) contain NULL or EMPTY values and will be displayed with their corresponding row indices: ",end='\n\n')
+  # Displaying the number of null values in each affected column
+  print(f"{len(nullinx)} row(s) contain NULL or EMPTY values, in the following column(s): ",end='\n\n')
+  print('COLUMN: NUMBER OF NULL VALUES',end='\n\n')
+  for name,count in nullcounts.items():
+    print(f'{name}: {count}')
+  print('\n')
+
+  # Displaying the first rows with detected nulls, along with their row indices, for user reference
+  print(f"The first {min(len(nullinx),NULL_SAMPLE_ROWS)} of these row(s) are displayed with their corresponding row indices: ",end='\n\n')
   print('ROW INDEX: ROW',end='\n\n')
-  for i in range(len(nullinx)):
-    print(f'{nullinx[i]}:',nullrow[i])
+  for i in nullinx[:NULL_SAMPLE_ROWS]:
+    print(f'{i}:',readtable[int(i)])
 
   # Informing the user regarding next steps: optional row deletion, caution when proceeding, or manual data cleanup
   print(">>> NEXT STEPS: Recommended actions to handle the null or empty values identified above.", end='\n\n')
@@ -79,7 +418,10 @@ if len(nullinx)!=0:
   print('*************************************************************************************************************************************************',end='\n\n')
 
 # Displaying the extracted table to user
-print(f"The catalog/table extracted from {fname} is (truncated for visualization convienience): ",end='\n\n')
+if streaming:
+  print(f"The FIRST BLOCK of the catalog/table in {fname} is (truncated for visualization convienience): ",end='\n\n')
+else:
+  print(f"The catalog/table extracted from {fname} is (truncated for visualization convienience): ",end='\n\n')
 print(readtable,end='\n\n')
 print('*************************************************************************************************************************************************',end='\n\n')
 
@@ -134,8 +476,16 @@ def save(newtable):
 
     # If user wants to overwrite the original data
     if och=='1':
-      # Overwriting the original data
-      newtable.write(fname,format=fmt,overwrite=True)
+      # Overwriting the original data is refused when only some of its columns were loaded, as the others would be lost
+      if usecols is not None:
+        print(f"ERROR: Only the columns {', '.join(usecols)} of {fname} were loaded in this session !!! Please save to a new file !!!",end='\n\n')
+        continue
+
+      # Overwriting the original data, after reading the columns of the (memory-mapped) original file still on disk
+      for table in (readtable,newtable):
+        if isinstance(table,LazyTable):
+          table.materialize()
+      (csv_table(newtable) if fmt=='csv' else newtable).write(fname,format=fmt,overwrite=True)
       print(f"The updated data has been saved to {fname} !!!",end='\n\n')
       break
 
@@ -153,7 +503,7 @@ def save(newtable):
       else:
         new_fmt='fits'
 
-      newtable.write(fname_new,format=new_fmt,overwrite=True)
+      (csv_table(newtable) if new_fmt=='csv' else newtable).write(fname_new,format=new_fmt,overwrite=True)
       print(f"The updated data has been saved to {fname_new} !!!",end='\n\n')
       break
 
@@ -173,6 +523,21 @@ def save(newtable):
     else:
       print("INVALID choice from Save Menu !!! Please enter a valid choice !!!")
 
+# Creating a function which returns a table that can be written to .csv: the vector columns (several values per row, e.g. all the
+# visibility windows of a star) are written as space separated values, as the .csv format has no vector columns
+def csv_table(table):
+  out=table
+  for col in table.colnames:
+    if table[col].ndim>1:
+      if out is table:
+        out=table.copy(copy_data=False)
+      vals=np.asarray(table[col]).reshape(len(table),-1).astype(str)
+      joined=vals[:,0] if vals.shape[1]>0 else np.full(len(table),'',dtype='U1')
+      for j in range(1,vals.shape[1]):
+        joined=np.char.add(np.char.add(joined,' '),vals[:,j])
+      out[col]=joined
+  return out
+
 ###################################################################################################################################################################################
 
 # Creating a function to display a table in either summarized or full view based on user input
@@ -188,6 +553,8 @@ def display(display_string,table_to_display):
   print('\n')
   print('*************************************************************************************************************************************************',end='\n\n')
 
+  table_to_display=display_view(table_to_display)
+
   if dispch!='2':
     print(display_string + ' (in default view)',end='\n\n')
     print(table_to_display,end='\n\n')                                          # Display the default summary view (Astropy's standard table print)
@@ -200,6 +567,33 @@ def display(display_string,table_to_display):
 
 ###################################################################################################################################################################################
 
+# Creating a function which converts MJD values (UTC) to ISO strings, nan values being shown as 'nan'
+def mjd_to_iso(vals):
+  vals=np.asarray(vals,dtype=float)
+  iso=np.full(vals.shape,'nan',dtype='U23')
+  ok=np.isfinite(vals)
+  if ok.any():
+    iso[ok]=Time(vals[ok],format='mjd',scale='utc').iso
+  return iso
+
+# Creating a function which returns the table to be displayed, with the MJD time columns shown as ISO dates (the table itself is unchanged)
+def display_view(table):
+  view=table
+  for col in table.colnames:
+    if table[col].description==MJD_DESCRIPTION and table[col].dtype.kind=='f':
+      if view is table:
+        view=table.copy(copy_data=False)
+      view[col]=mjd_to_iso(table[col])
+  return view
+
+# Creating a function which stores float64 MJD values (UTC) as a table column with unit metadata, without copying them
+def put_mjd_column(table,name,values):
+  put_column(table,name,np.asarray(values,dtype=np.float64))
+  table[name].unit=u.d
+  table[name].description=MJD_DESCRIPTION
+
+###################################################################################################################################################################################
+
 # Creating a function which prompts the user until a valid float or int is entered, based on dtype
 def only_num(inpl,dtype):
   # Repeatedly ask until a valid int / float is entered
@@ -225,8 +619,1369 @@ def only_num(inpl,dtype):
 
 ###################################################################################################################################################################################
 
-# Initializing stars_alt here to ensure it always exists
-stars_alt = []
+# Creating a function which asks the user for the altitude threshold of the stars (degrees) and returns it
+# Ensuring that the value belongs to the expected range of [5,15], the general use threshold of 15° being assumed otherwise
+def ask_minalt():
+  minalt=only_num("Enter a valid altitude threshold (in degrees) in the range [5°,15°]: ",'float')
+  print('\n')
+  if not 5<=minalt<=15:
+    print("The altitude threshold entered was not in the valid range of [5°,15°] !!! Defaulting to the general use altitude threshold of 15°.",end='\n\n')
+    minalt=15
+  return minalt
+
+# Creating a function which asks the user for the name, latitude, longitude and elevation of an observing site and returns them
+def ask_site(num):
+  sitename=input(f"Enter a short name for site no. {num} (used as prefix of its columns, e.g., LaPalma): ").strip()
+
+  # Latitude, longitude and elevation are validated with the same ranges as the observer's location
+  while True:
+    sitelat=only_num(f"Enter the latitude of site {sitename} (in degrees): ",'float')
+    if -90<=sitelat<=90:
+      break
+    print(f"Please ENTER CORRECT values !!! The latitude {sitelat}° provided is OUT of -90° to +90° range !!!",end='\n\n')
+
+  while True:
+    sitelon=only_num(f"Enter the longitude of site {sitename} (in degrees): ",'float')
+    if -180<sitelon<180:
+      break
+    print(f"Please ENTER CORRECT values !!! The longitude {sitelon}° provided is OUT of -180° to +180° range !!!",end='\n\n')
+
+  while True:
+    siteele=only_num(f"Enter elevation of site {sitename} above sea level (in meters), if unknown enter 0: ",'float')
+    if siteele>=0:
+      break
+    print(f"Please ENTER CORRECT values !!! The elevation {siteele} meters provided is less than zero !!!",end='\n\n')
+
+  print('\n')
+  return sitename,sitelat,sitelon,siteele
+
+###################################################################################################################################################################################
+
+# Creating a function which checks a whole column of a table against the range [low,high) (or [low,high] if closed) in a single pass
+# Missing (masked) and nan values are counted as out of range
+# Returns a dictionary with the column, the range, the count of offending rows and the indices and values of the first limit of them
+def check_range(table,col,low,high,closed=False,limit=5):
+  vals=np.ma.filled(np.ma.asarray(table[col],dtype=float),np.nan)            # Masked values become nan, which fails both comparisons
+  bad=np.flatnonzero(~((vals>=low)&((vals<=high) if closed else (vals<high))))
+  return {'column':col,'range':f"[{low}°,{high}°{']' if closed else ')'}",'count':len(bad),'indices':bad[:limit],'values':vals[bad[:limit]]}
+
+# Creating a function which prints the offending rows of a range check result (if any)
+def report_range(result):
+  if result['count']:
+    rows=', '.join(f"row no. {index} ({val})" for index,val in zip(result['indices'],result['values']))
+    print(f"{result['count']} value(s) for the column {result['column']} provided are not in the range {result['range']} !!! First offending: {rows}")
+  return result
+
+# Creating functions which verify that all the values in a column for a given table are in the range of [0,360) and [-90,90] respectively
+def inrange360(table,col):
+  return report_range(check_range(table,col,0,360))
+
+def inrange90(table,col):
+  return report_range(check_range(table,col,-90,90,closed=True))
+
+###################################################################################################################################################################################
+
+# Creating a function which returns the RA/Dec columns (in degrees) of a table as float arrays, optionally propagated from the catalog epoch
+# to obstime with the proper motions (and, if available, radial velocities and distances) of the table, as asked from the user
+def epoch_positions(table,ra,dec,obstime):
+  raval=np.asarray(table[ra],dtype=float)
+  decval=np.asarray(table[dec],dtype=float)
+
+  chpm=input("If you want to propagate the positions to the observation date using proper motions, type (y / Y / yes / YES): ")
+  print('\n')
+  if chpm not in ['y','Y','yes','YES']:
+    return raval,decval
+
+  print("NOTE: EPOCH PROPAGATION",end='\n\n')
+  print('*************************************************************************************************************************************************',end='\n\n')
+  print("> Proper motions MUST be in mas/yr, the RA component INCLUDING the cos(Dec) factor (as in Hipparcos and Gaia).")
+  print("> Radial velocities (km/s) and distances (pc) are optional; without them the stars only move on the sky.")
+  print("> Press ENTER to use the default column name shown in brackets, or type 'none' to skip an optional column.",end='\n\n')
+  print('*************************************************************************************************************************************************',end='\n\n')
+
+  cols={}
+  for key,default,optional in [('pmra','Proper_Motion_RA',False),('pmdec','Proper_Motion_Dec',False),('rv','Radial_Velocity',True),('dist','Distance_pc',True)]:
+    col=input(f"Enter the name of the column consisting of {key} values [{default}]: ").strip() or default
+    if optional and col.lower()=='none':
+      cols[key]=None
+      continue
+    if col not in table.colnames or table[col].dtype.kind not in 'iuf':
+      print('\n')
+      print(f"The column {col} provided does not exist in the table or is not numeric !!! The positions are used WITHOUT propagation.",end='\n\n')
+      return raval,decval
+    cols[key]=np.ma.filled(np.ma.asarray(table[col],dtype=float),0 if key!='dist' else np.nan)   # Missing motions are taken as zero
+  print('\n')
+
+  epoch=only_num("Enter the epoch of the catalog positions (in Julian years, e.g., 2000 for J2000.0, 2016 for Gaia DR3): ",'float')
+  print('\n')
+  dt=obstime.jyear-epoch
+  newra,newdec=propagate_epoch(raval,decval,cols['pmra'],cols['pmdec'],dt,cols['rv'],cols['dist'])
+
+  hav=np.sin(np.radians(newdec-decval)/2)**2+np.cos(np.radians(decval))*np.cos(np.radians(newdec))*np.sin(np.radians(newra-raval)/2)**2
+  shift=np.degrees(2*np.arcsin(np.sqrt(hav)))*3600                             # Haversine separation (in arcsec), accurate for small shifts
+  print(f"The positions were propagated by {dt:.2f} years (largest shift {np.nanmax(shift,initial=0):.2f} arcsec, median {np.nanmedian(shift) if len(shift) else 0:.3f} arcsec).",end='\n\n')
+  return newra,newdec
+
+# Creating a function which converts coordinates to or from AltAz (options 1c to 1f), asking the user whether the fast AltAz mode is
+# to be used; in that case the measured error of a random sample of rows against the exact astropy transform is reported
+def altaz_conversion(kind,aval,bval,obstime,lat,lon,ele):
+  print('*************************************************************************************************************************************************',end='\n\n')
+  print("> The FAST AltAz mode rotates every star with one precomputed precession-nutation and Earth rotation matrix per time,")
+  print("> instead of the full astropy transform; it is accurate to ~0.2 arcsec (plenty for scheduling) and much faster on large tables.",end='\n\n')
+  chfa=input("If you want to use the FAST AltAz mode, type (y / Y / yes / YES): ")
+  print('\n')
+  if chfa not in ['y','Y','yes','YES']:
+    return convert_columns(kind,aval,bval,obstime,lat,lon,ele)
+
+  newa,newb=convert_columns('fast-'+kind,aval,bval,obstime,lat,lon,ele)
+
+  # Measuring the error of the fast mode against the exact transform on a random sample of rows
+  rows=np.random.default_rng(0).choice(len(newa),min(200,len(newa)),replace=False)
+  exa,exb=convert_block(kind,np.asarray(aval,dtype=float)[rows],np.asarray(bval,dtype=float)[rows],obstime,lat,lon,ele)
+  lonf,latf,lone,late=(newb[rows],newa[rows],exb,exa) if kind.endswith('-altaz') else (newa[rows],newb[rows],exa,exb)
+  hav=np.sin(np.radians(latf-late)/2)**2+np.cos(np.radians(latf))*np.cos(np.radians(late))*np.sin(np.radians(lonf-lone)/2)**2
+  err=np.degrees(2*np.arcsin(np.sqrt(hav)))*3600
+  if err.size:
+    print(f"FAST AltAz accuracy on {len(rows)} random rows: largest error {err.max():.3f} arcsec, median {np.median(err):.4f} arcsec.",end='\n\n')
+  return newa,newb
+
+# Creating a function which returns the version tag of cached results, so that entries computed with other astropy or IERS data are never reused
+def cache_version():
+  iersver=astropy_iers_data.__version__ if astropy_iers_data is not None else 'bundled'
+  return f"v1-astropy{astropy.__version__}-iers{iersver}-{IERS_TAG}"
+
+# Creating a function which creates the cache key (file name) for the given parameters and the current cache version
+def cache_key(*parts):
+  return hashlib.sha1('|'.join([cache_version()]+[str(p) for p in parts]).encode()).hexdigest()
+
+# Creating a function which loads a cache entry of a given kind (sub-directory) as a dictionary of arrays, or returns None if it is missing
+# The entry's modification time is refreshed on every hit, which is what the least recently used eviction relies on
+def cache_load(kind,key):
+  path=os.path.join(CACHE_DIR,kind,key+'.npz')
+  try:
+    with np.load(path) as entry:
+      data={name:entry[name] for name in entry.files}
+    os.utime(path)
+  except (OSError,ValueError,KeyError,zipfile.BadZipFile):                      # Missing, unreadable or corrupted (e.g., truncated) entry
+    return None
+  return data
+
+# Creating a function which opens the grid (large array) stored with a cache entry memory-mapped, or returns None if it is missing
+def cache_grid(kind,key):
+  try:
+    return np.load(os.path.join(CACHE_DIR,kind,key+'.npy'),mmap_mode='r')
+  except (OSError,ValueError):                                                  # Missing, unreadable or corrupted grid
+    return None
+
+# Creating a function which stores the arrays as a cache entry and evicts the least recently used entries beyond the disk budget (in bytes)
+# A large array (e.g., an altitude grid) can be given as grid: it is stored as a separate .npy file, which cache_grid memory-maps instead of
+# loading; an entry larger than the whole budget is not stored at all, as it would be evicted at once
+def cache_store(kind,key,budget,grid=None,**arrays):
+  if sum(np.asarray(a).nbytes for a in arrays.values())+(grid.nbytes if grid is not None else 0)>budget:
+    return
+  folder=os.path.join(CACHE_DIR,kind)
+  try:
+    os.makedirs(folder,exist_ok=True)
+    gridpath=os.path.join(folder,key+'.npy')
+    tmp=os.path.join(folder,key+'.tmp')
+    if grid is not None:
+      with open(tmp,'wb') as f:
+        np.save(f,grid)
+      os.replace(tmp,gridpath)
+    elif os.path.exists(gridpath):
+      os.remove(gridpath)
+    with open(tmp,'wb') as f:
+      np.savez(f,**arrays)
+    os.replace(tmp,os.path.join(folder,key+'.npz'))                           # Renaming ensures that a half-written entry is never loaded (the grid is written first)
+
+    entries=sorted((os.path.join(folder,name[:-4]) for name in os.listdir(folder) if name.endswith('.npz')),key=lambda path: os.path.getmtime(path+'.npz'),reverse=True)
+    used=0
+    for path in entries:
+      used+=os.path.getsize(path+'.npz')+(os.path.getsize(path+'.npy') if os.path.exists(path+'.npy') else 0)
+      if used>budget:
+        os.remove(path+'.npz')
+        if os.path.exists(path+'.npy'):
+          os.remove(path+'.npy')
+  except OSError:                                                               # A read-only or full disk only disables caching
+    pass
+
+###################################################################################################################################################################################
+
+# Creating a function which returns the fixed 3x3 rotation matrix from ICRS to Galactic coordinates
+# The matrix is derived once per session by transforming the ICRS basis vectors with astropy, and is checked against astropy
+# on a set of test positions (including the poles) to agree within 1e-9 degrees before it is used
+def galactic_matrix():
+  global GALACTIC_MATRIX
+  if GALACTIC_MATRIX is None:
+    basis=sc(ra=[0,90,0]*u.deg,dec=[0,0,90]*u.deg,frame='icrs').transform_to('galactic').cartesian    # Images of the x, y and z unit vectors
+    matrix=np.array([basis.x.value,basis.y.value,basis.z.value])              # Column j is the image of the j-th basis vector
+
+    testra=np.concatenate([np.linspace(0,359.9,37),[0,0,123.4,321]])
+    testdec=np.concatenate([np.linspace(-89.9,89.9,37),[90,-90,45,-30]])
+    ref=sc(ra=testra*u.deg,dec=testdec*u.deg,frame='icrs').transform_to('galactic')
+    l,b=rotate_lonlat(testra,testdec,matrix)
+    dev=sc(l=l*u.deg,b=b*u.deg,frame='galactic').separation(ref).deg
+    if np.max(dev)>1e-9:
+      raise ValueError(f"The cached ICRS to Galactic rotation deviates from astropy by {np.max(dev)}° !!!")
+    GALACTIC_MATRIX=matrix
+  return GALACTIC_MATRIX
+
+# Creating a function which rotates longitude/latitude columns (in degrees) with a 3x3 rotation matrix, in row chunks
+# Each chunk is converted to unit vectors, rotated with one matrix product and converted back; longitudes are returned in [0°,360°)
+def rotate_lonlat(lonval,latval,matrix,chunk=1000000):
+  lonval=np.asarray(lonval,dtype=float)
+  latval=np.asarray(latval,dtype=float)
+  newlon=np.empty(len(lonval))
+  newlat=np.empty(len(latval))
+
+  for start in range(0,len(lonval),chunk):
+    stop=min(start+chunk,len(lonval))
+    lonrad=np.radians(lonval[start:stop])
+    latrad=np.radians(latval[start:stop])
+    coslat=np.cos(latrad)
+    vec=matrix@np.stack([coslat*np.cos(lonrad),coslat*np.sin(lonrad),np.sin(latrad)])
+    newlon[start:stop]=np.degrees(np.arctan2(vec[1],vec[0]))
+    newlat[start:stop]=np.degrees(np.arctan2(vec[2],np.hypot(vec[0],vec[1])))
+
+  np.add(newlon,360,out=newlon,where=newlon<0)                                 # Wrapping (-180°,180°] to [0°,360°)
+  newlon[newlon>=360]=0                                                        # Tiny negative longitudes round to exactly 360° when wrapped
+  return newlon,newlat
+
+###################################################################################################################################################################################
+
+# Creating a function which propagates positions (in degrees) by dt Julian years of linear space motion, in row chunks
+# Every star moves along a straight line in space: its unit vector gains the proper motion (pmra including cos(Dec), pmdec, in mas/yr)
+# along the local east and north directions and is stretched by the radial distance change rv*dt/dist (rv in km/s, dist in pc)
+# A star without a (positive) distance only moves on the sky; the light-time terms of astropy's apply_space_motion are neglected
+# (agrees with it to well below 1 mas for dt of decades)
+def propagate_epoch(raval,decval,pmra,pmdec,dt,rv=None,dist=None,chunk=CONVERSION_CHUNK):
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+  pmra=np.asarray(pmra,dtype=float)
+  pmdec=np.asarray(pmdec,dtype=float)
+  newra=np.empty(len(raval))
+  newdec=np.empty(len(decval))
+  masyr=np.radians(1/3600000)*dt                                               # Radians moved per mas/yr of proper motion
+  kmsyr=(1*u.km/u.s*u.yr).to_value(u.pc)*dt                                     # Parsecs moved per km/s of radial velocity
+
+  for start in range(0,len(raval),chunk):
+    stop=min(start+chunk,len(raval))
+    rarad=np.radians(raval[start:stop])
+    decrad=np.radians(decval[start:stop])
+    sinra,cosra=np.sin(rarad),np.cos(rarad)
+    sindec,cosdec=np.sin(decrad),np.cos(decrad)
+    east=pmra[start:stop]*masyr
+    north=pmdec[start:stop]*masyr
+    stretch=1.0
+    if rv is not None and dist is not None:
+      d=np.asarray(dist[start:stop],dtype=float)
+      stretch=1+np.where(d>0,np.asarray(rv[start:stop],dtype=float)*kmsyr/np.where(d>0,d,1),0)
+
+    x=cosdec*cosra*stretch-sinra*east-sindec*cosra*north
+    y=cosdec*sinra*stretch+cosra*east-sindec*sinra*north
+    z=sindec*stretch+cosdec*north
+    newra[start:stop]=np.degrees(np.arctan2(y,x))
+    newdec[start:stop]=np.degrees(np.arctan2(z,np.hypot(x,y)))
+
+  np.add(newra,360,out=newra,where=newra<0)                                    # Wrapping (-180°,180°] to [0°,360°)
+  newra[newra>=360]=0
+  return newra,newdec
+
+###################################################################################################################################################################################
+
+# Creating a function which precomputes the terms of the fast AltAz mode once per time sample (times, at location) with ERFA
+# For every time sample, the bias-precession-nutation matrix, the Earth rotation angle (with longitude), polar motion and the latitude
+# are combined into a single 3x3 rotation from aberrated ICRS (GCRS) directions to the local horizon (x south, y east, z up);
+# the observer's barycentric velocity (in units of c, including the diurnal motion) is kept for the aberration
+# Returns the (times x 3 x 3) rotations and the (times x 3) velocities
+def fast_altaz_terms(times,location):
+  astrom=erfa_astrom.get().apco(aa(obstime=times.reshape(-1),location=location))
+  nt=len(astrom)
+  cosera,sinera=np.cos(astrom['eral']),np.sin(astrom['eral'])
+  era=np.zeros((nt,3,3))                                                        # Earth rotation (with longitude), CIRS to -HA/Dec
+  era[:,0,0],era[:,0,1],era[:,1,0],era[:,1,1],era[:,2,2]=cosera,sinera,-sinera,cosera,1
+  polar=np.tile(np.eye(3),(nt,1,1))                                              # Polar motion, to first order as in ERFA
+  polar[:,0,2],polar[:,1,2],polar[:,2,0],polar[:,2,1]=astrom['xpl'],-astrom['ypl'],-astrom['xpl'],astrom['ypl']
+  horizon=np.zeros((nt,3,3))                                                     # -HA/Dec to the local horizon at the latitude
+  horizon[:,0,0],horizon[:,0,2],horizon[:,1,1],horizon[:,2,0],horizon[:,2,2]=astrom['sphi'],-astrom['cphi'],1,astrom['cphi'],astrom['sphi']
+  return horizon@polar@era@astrom['bpn'],astrom['v']
+
+# Creating a function which transforms stars (RA/Dec in degrees) to AltAz for every time sample of the fast AltAz terms
+# The aberration is applied to first order in v/c (p + v - (p.v) p), so that every component of the horizon direction is a linear
+# combination of a few (stars x 3) @ (3 x times) matrix products; light deflection by the Sun and refraction are neglected
+# ERROR BOUND: agrees with the exact astropy AltAz transform to ~0.2 arcsec or better above the horizon (measured by fast_altaz_accuracy())
+# Returns the (stars x times) altitudes and, if azimuth is True, azimuths (in degrees)
+def fast_altaz(raval,decval,terms,azimuth=True):
+  rot,vel=terms
+  rarad=np.radians(np.asarray(raval,dtype=float))
+  decrad=np.radians(np.asarray(decval,dtype=float))
+  vec=np.stack([np.cos(decrad)*np.cos(rarad),np.cos(decrad)*np.sin(rarad),np.sin(decrad)],axis=1)
+  damp=1-vec@vel.T                                                              # 1 - p.v for every star and time sample
+  shift=np.einsum('tij,tj->it',rot,vel)                                         # Rotated velocity of every time sample
+
+  up=damp*(vec@rot[:,2,:].T)+shift[2]
+  if not azimuth:
+    norm=np.sqrt(1+(vel**2).sum(axis=1)-(1-damp)**2)                            # Length of p + v - (p.v) p, so that the altitude stays exact near the zenith
+    return np.degrees(np.arcsin(np.clip(up/norm,-1,1))),None
+  south=damp*(vec@rot[:,0,:].T)+shift[0]
+  east=damp*(vec@rot[:,1,:].T)+shift[1]
+  alt=np.degrees(np.arctan2(up,np.hypot(south,east)))
+  az=np.degrees(np.arctan2(east,-south))
+  np.add(az,360,out=az,where=az<0)
+  return alt,az
+
+# Creating a function which transforms AltAz coordinates (in degrees) of a single time sample back to RA/Dec with the fast AltAz terms
+# The inverse rotation is applied and the first order aberration is removed (p = p' - v + (p'.v) p')
+def fast_radec(altval,azval,terms):
+  rot,vel=terms[0][0],terms[1][0]
+  altrad=np.radians(np.asarray(altval,dtype=float))
+  azrad=np.radians(np.asarray(azval,dtype=float))
+  hor=np.stack([-np.cos(altrad)*np.cos(azrad),np.cos(altrad)*np.sin(azrad),np.sin(altrad)],axis=1)
+  vec=hor@rot                                                                   # Transpose of the rotation applied to every row
+  vec=vec-vel+(vec@vel)[:,None]*vec
+  ra=np.degrees(np.arctan2(vec[:,1],vec[:,0]))
+  np.add(ra,360,out=ra,where=ra<0)
+  return ra,np.degrees(np.arctan2(vec[:,2],np.hypot(vec[:,0],vec[:,1])))
+
+# Creating a function which measures the error of the fast AltAz mode against the exact astropy transform, on a random sample of
+# stars and (up to) ntimes evenly spaced time samples; returns the largest and median angular errors (in arcsec) above the horizon
+# (below it, astropy's topocentric corrections make the difference grow to ~0.5 arcsec, which never affects a visibility window)
+def fast_altaz_accuracy(raval,decval,times,location,sample=200,ntimes=20):
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+  rows=np.random.default_rng(0).choice(len(raval),min(sample,len(raval)),replace=False)
+  times=times.reshape(-1)[np.unique(np.linspace(0,times.size-1,min(ntimes,times.size)).astype(int))]
+
+  alt,az=fast_altaz(raval[rows],decval[rows],fast_altaz_terms(times,location))
+  exact=sc(ra=raval[rows,None]*u.deg,dec=decval[rows,None]*u.deg,frame='icrs').transform_to(aa(obstime=times[None,:],location=location))
+  exalt,exaz=np.radians(exact.alt.value),np.radians(exact.az.value)
+  hav=np.sin((np.radians(alt)-exalt)/2)**2+np.cos(np.radians(alt))*np.cos(exalt)*np.sin((np.radians(az)-exaz)/2)**2
+  err=np.degrees(2*np.arcsin(np.sqrt(hav)))[exalt>0]*3600
+  return (err.max(),np.median(err)) if err.size else (np.nan,np.nan)
+
+###################################################################################################################################################################################
+
+# Creating a function which converts one block of coordinates (in degrees) for the conversion kind, e.g. 'icrs-galactic'
+# AltAz inputs and outputs are ordered as (altitude, azimuth); the ICRS <-> Galactic kinds use the cached rotation matrix
+# The AltAz kinds prefixed with 'fast-' (e.g., 'fast-icrs-altaz') use the fast AltAz mode instead of the exact astropy transform
+def convert_block(kind,aval,bval,obstime=None,lat=0,lon=0,ele=0):
+  if kind=='icrs-galactic':
+    return rotate_lonlat(aval,bval,galactic_matrix())
+  if kind=='galactic-icrs':
+    return rotate_lonlat(aval,bval,galactic_matrix().T)
+
+  location=el(lat=lat*u.deg,lon=lon*u.deg,height=ele*u.m)
+  if kind.startswith('fast-'):
+    terms=fast_altaz_terms(obstime,location)
+    if kind=='fast-galactic-altaz':
+      aval,bval=rotate_lonlat(aval,bval,galactic_matrix().T)
+    if kind.endswith('-altaz'):
+      alt,az=fast_altaz(aval,bval,terms)
+      return alt[:,0],az[:,0]
+    raval,decval=fast_radec(aval,bval,terms)
+    return (raval,decval) if kind=='fast-altaz-icrs' else rotate_lonlat(raval,decval,galactic_matrix())
+
+  if kind=='icrs-altaz':
+    cood=sc(ra=aval*u.deg,dec=bval*u.deg,frame='icrs')
+  elif kind=='galactic-altaz':
+    cood=sc(l=aval*u.deg,b=bval*u.deg,frame='galactic')
+  else:
+    cood=sc(alt=aval*u.deg,az=bval*u.deg,frame='altaz',obstime=obstime,location=location)
+
+  if kind.endswith('-altaz'):
+    newcood=cood.transform_to(aa(obstime=obstime,location=location))
+    return newcood.alt.value,newcood.az.value
+  if kind=='altaz-icrs':
+    newcood=cood.transform_to('icrs')
+    return newcood.ra.value,newcood.dec.value
+  newcood=cood.transform_to('galactic')
+  return newcood.l.value,newcood.b.value
+
+# Creating a function which returns the peak resident memory (in MB) of this process plus that of its largest finished worker process
+def peak_memory():
+  if resource is None:
+    return None
+  scale=1024**2 if sys.platform=='darwin' else 1024                            # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+  return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss+resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)/scale
+
+# Creating a function which converts two coordinate columns in fixed size row blocks, distributing the blocks of the AltAz conversions over a pool of
+# worker processes and writing every converted block straight into preallocated output arrays
+# Progress is printed per block and the peak memory is reported at the end
+def convert_columns(kind,aval,bval,obstime=None,lat=0,lon=0,ele=0,chunk=CONVERSION_CHUNK,workers=None):
+  aval=np.asarray(aval,dtype=float)
+  bval=np.asarray(bval,dtype=float)
+  newa=np.empty(len(aval))
+  newb=np.empty(len(bval))
+
+  bounds=[(start,min(start+chunk,len(aval))) for start in range(0,len(aval),chunk)]
+  tasks=[[kind]*len(bounds),[aval[start:stop] for start,stop in bounds],[bval[start:stop] for start,stop in bounds],
+         [obstime]*len(bounds),[lat]*len(bounds),[lon]*len(bounds),[ele]*len(bounds)]
+
+  # Only the AltAz conversions (astropy / ERFA) are distributed: the Galactic rotations are pure NumPy, and would spend more time sending the blocks
+  # to the workers than converting them; a single block is converted in this process, as are all the blocks where forking is unavailable
+  if len(bounds)>1 and 'altaz' in kind and workers!=1 and 'fork' in multiprocessing.get_all_start_methods():
+    pool=ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('fork'))
+    results=pool.map(convert_block,*tasks)
+  else:
+    pool=None
+    results=map(convert_block,*tasks)
+
+  try:
+    for k,(result,(start,stop)) in enumerate(zip(results,bounds)):
+      newa[start:stop],newb[start:stop]=result
+      if len(bounds)>1:
+        print(f"Block {k+1}/{len(bounds)} converted (rows {start} to {stop-1}).")
+  finally:
+    if pool is not None:
+      pool.shutdown(cancel_futures=True)
+
+  peak=peak_memory()
+  if peak is not None:
+    print(f"Converted {len(aval)} rows in {len(bounds)} block(s); peak memory {peak:.1f} MB (this process plus the largest worker).",end='\n\n')
+
+  return newa,newb
+
+# Creating a function which stores an array as a table column without copying it (replacing any column of the same name)
+def put_column(table,name,values):
+  if name in table.colnames:
+    table.replace_column(name,values,copy=False)
+  else:
+    table.add_column(values,name=name,copy=False)
+
+###################################################################################################################################################################################
+
+# Creating a function which applies one step of a streaming pipeline to a block of rows and returns the resulting block
+# The steps are tuples: ('filter', column, condition, value) with condition '>', '<', '==' or 'range' (value = (min, max), exclusive),
+# ('derive', quantity, input columns, new column) with the formulas of the derived quantity menu, and
+# ('convert', kind, input columns, new columns, (obstime, lat, lon, ele)) with a conversion kind of convert_block()
+def apply_step(block,step):
+  if step[0]=='filter':
+    col,cond,val=block[step[1]],step[2],step[3]
+    if cond=='>':
+      keep=col>val
+    elif cond=='<':
+      keep=col<val
+    elif cond=='==':
+      keep=col==val
+    else:
+      keep=(col>val[0])&(col<val[1])
+    return block[np.ma.filled(keep,False)]                                      # Rows with missing values never pass a filter
+
+  if step[0]=='derive':
+    vals=[block[col] for col in step[2]]
+    if step[1] in ['parallax','distance']:
+      block[step[3]]=1000/vals[0]
+    elif step[1]=='absmag':
+      block[step[3]]=vals[0]+(5*(np.log10(vals[1])))-10
+    elif step[1]=='luminosity':
+      block[step[3]]=10**((0.4)*(4.83-vals[0]))
+    else:
+      block[step[3]]=vals[0]-vals[1]
+    return block
+
+  if len(block)==0:
+    newa=newb=np.empty(0)
+  else:
+    newa,newb=convert_block(step[1],np.ma.filled(np.ma.asarray(block[step[2][0]],dtype=float),np.nan),
+                            np.ma.filled(np.ma.asarray(block[step[2][1]],dtype=float),np.nan),*step[4])
+  put_column(block,step[3][0],newa)
+  put_column(block,step[3][1],newb)
+  return block
+
+# Creating a function which runs a streaming pipeline (list of steps of apply_step()) over a .csv catalog block by block, writing
+# every resulting block to the new .csv file outname as soon as it is ready, so that neither file is ever held whole in memory
+# Returns the number of rows read and written and the runtime (in seconds)
+def stream_csv(fname,outname,steps,rows=CSV_BLOCK_ROWS,names=None):
+  nread=nwritten=0
+  clock=datetime.now()
+  tmp=outname+'.tmp'
+  try:
+    with open(tmp,'w') as out:
+      for k,block in enumerate(csv_blocks(fname,rows,names)):
+        nread+=len(block)
+        for step in steps:
+          block=apply_step(block,step)
+        buf=io.StringIO()
+        csv_table(block).write(buf,format='ascii.csv')
+        out.write(buf.getvalue() if k==0 else buf.getvalue().split('\n',1)[1]) # The header is only written with the first block
+        nwritten+=len(block)
+        print(f"Block {k+1}: {nread} rows read, {nwritten} rows written.")
+  except BaseException:                                                         # Including an interruption (Ctrl+C)
+    if os.path.exists(tmp):
+      os.remove(tmp)                                                            # The partial output (possibly many GB) is not left on disk
+    raise
+  os.replace(tmp,outname)                                                       # A run that fails midway never leaves a truncated output file
+  return nread,nwritten,(datetime.now()-clock).total_seconds()
+
+###################################################################################################################################################################################
+
+# Creating a function which calculates the altitude of every star for every time step using a single broadcasted transform
+# The stars are processed in chunks (rows) so that the (stars x times) intermediate arrays created by astropy stay within memory
+def star_altitudes(raval,decval,aaf,chunk=2000):
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+
+  altmat=np.empty((len(raval),len(aaf.obstime)))                               # Altitude of each star (row) for each time step (column) of the AltAz frame
+
+  for start in range(0,len(raval),chunk):
+    stop=min(start+chunk,len(raval))
+    # Column vectors of coordinates are broadcast against the row vector of times in the AltAz frame
+    cood=sc(ra=raval[start:stop,None]*u.deg,dec=decval[start:stop,None]*u.deg,frame='icrs')
+    altmat[start:stop]=cood.transform_to(aaf).alt.value
+
+  return altmat
+
+###################################################################################################################################################################################
+
+# Creating a function which finds, for every star, the first time step above the altitude threshold (rise)
+# and the first time step below the threshold after that rise (set); -1 is returned where no such time step exists
+def window_indices(altmat,minalt):
+  above=altmat>minalt
+  risen=above.any(axis=1)
+  rise=np.where(risen,np.argmax(above,axis=1),-1)
+
+  # Only the time steps after the rise of a star are searched for its set
+  after=np.arange(altmat.shape[1])[None,:]>rise[:,None]
+  below=(altmat<minalt)&after&risen[:,None]
+  setidx=np.where(below.any(axis=1),np.argmax(below,axis=1),-1)
+
+  return rise,setidx
+
+# Creating a function which finds EVERY visibility window (run of time steps above the threshold) of every star with vectorized mask differences
+# The windows are returned as a ragged structure: the windows of star i are start[offsets[i]:offsets[i+1]] and end[offsets[i]:offsets[i+1]],
+# where start is the first time step above the threshold and end the first time step after it that is not (len(times) if still open at the last step)
+# Samples can additionally be excluded with the boolean mask allowed (broadcast against altmat), e.g. by the Moon constraints
+def window_intervals(altmat,minalt,allowed=None):
+  above=np.zeros((altmat.shape[0],altmat.shape[1]+2),dtype=np.int8)           # Padded with a step below the threshold on both sides
+  above[:,1:-1]=altmat>minalt if allowed is None else (altmat>minalt)&allowed
+  edges=np.diff(above,axis=1)
+  star,start=np.nonzero(edges==1)                                              # Row-major order, so the windows come sorted by star and time
+  end=np.nonzero(edges==-1)[1]
+
+  return ragged_offsets(star,altmat.shape[0]),start,end
+
+# Creating a function which returns the offsets of a ragged structure from the (sorted) star index of every entry
+def ragged_offsets(star,nstars):
+  return np.concatenate([[0],np.cumsum(np.bincount(star,minlength=nstars))])
+
+# Creating a function which allocates the contiguous (stars x times) altitude grid kept for the Altitude vs Time plots
+# The grid is held in memory, or backed by a memory mapped file at path so that only the rows in use are paged in
+# The file must not exist yet (FileExistsError), unless it backed an earlier grid of this session; it is removed when the session ends
+def altitude_grid(nstars,ntimes,dtype='float32',path=None):
+  if path:
+    if path in SCRATCH_FILES:
+      remove_scratch(path)
+    with open(path,'xb') as f:                                                  # Exclusive creation never overwrites a catalog or results file
+      f.truncate(nstars*ntimes*np.dtype(dtype).itemsize)
+    SCRATCH_FILES.add(path)
+    return np.memmap(path,dtype=dtype,mode='r+',shape=(nstars,ntimes))
+  return np.empty((nstars,ntimes),dtype=dtype)
+
+# Creating a function which removes a file backing an altitude grid, or all of them (path None) when the session ends
+def remove_scratch(path=None):
+  for name in ([path] if path is not None else list(SCRATCH_FILES)):
+    try:
+      os.remove(name)
+    except OSError:
+      pass
+    SCRATCH_FILES.discard(name)
+
+atexit.register(remove_scratch)                                                 # Removing the files backing the altitude grids when the session ends
+
+# Creating a function which calculates the altitudes of the stars in chunks, storing them in the altitude grid out (any dtype),
+# and finds every visibility window from the full precision altitudes of each chunk before they are stored
+# With the Moon ephemeris of the time steps (see moon_ephemeris()), the samples failing the Moon constraints of moon_mask() are excluded as well
+# With the fast AltAz terms of the time steps (see fast_altaz_terms()), the altitudes are calculated by fast_altaz() instead of astropy
+# Returns the windows as the ragged structure of window_intervals()
+def altitude_windows(raval,decval,aaf,minalt,out,chunk=2000,moon=None,minsep=None,maxillum=None,terms=None):
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+  star,start,end=[],[],[]
+
+  for first in range(0,len(raval),chunk):
+    stop=min(first+chunk,len(raval))
+    if terms is None:
+      altmat=star_altitudes(raval[first:stop],decval[first:stop],aaf,chunk=chunk)
+    else:
+      altmat=fast_altaz(raval[first:stop],decval[first:stop],terms,azimuth=False)[0]
+    allowed=moon_mask(raval[first:stop],decval[first:stop],moon,minsep,maxillum) if moon is not None else None
+    offsets,cstart,cend=window_intervals(altmat,minalt,allowed)
+    star.append(first+np.repeat(np.arange(stop-first),np.diff(offsets)))
+    start.append(cstart)
+    end.append(cend)
+    out[first:stop]=altmat
+
+  return ragged_offsets(np.concatenate(star),len(raval)),np.concatenate(start),np.concatenate(end)
+
+# Creating a function which returns the altitude (in degrees) at which the plane-parallel airmass sec(z) = 1/sin(alt) equals maxairmass,
+# so that an airmass limit is applied to the altitudes already calculated as a stricter altitude threshold
+def airmass_altitude(maxairmass):
+  return np.degrees(np.arcsin(1/maxairmass))
+
+# Creating a function which calculates the Moon ephemeris once for all the time steps of a night, to be broadcast against all the stars
+# Returns the topocentric direction of the Moon (unit vectors in the ICRS aligned GCRS axes, shape (3 x times)), its altitude and its illuminated fraction
+def moon_ephemeris(times,location):
+  moon=get_body('moon',times,location)
+  sun=get_body('sun',times,location)
+  moonalt=moon.transform_to(aa(obstime=times,location=location)).alt.deg
+
+  # Illuminated fraction (1 + cos(i)) / 2 from the phase angle i, given by the Sun-Moon elongation and the distances of both
+  elong=moon.separation(sun).rad
+  dsun=sun.distance.to_value(u.km)
+  phase=np.arctan2(dsun*np.sin(elong),moon.distance.to_value(u.km)-dsun*np.cos(elong))
+  illum=(1+np.cos(phase))/2
+
+  ra,dec=moon.ra.rad,moon.dec.rad
+  return {'vec':np.array([np.cos(dec)*np.cos(ra),np.cos(dec)*np.sin(ra),np.sin(dec)]),'alt':moonalt,'illum':illum}
+
+# Creating a function which returns the (stars x times) mask of the samples satisfying the Moon constraints, which only apply while the Moon is above
+# the horizon: the star must be at least minsep (degrees) away from the Moon and the Moon's illuminated fraction must not exceed maxillum
+# The separations come from one matrix product of the star and Moon unit vectors (agrees with astropy to ~20 arcsec)
+def moon_mask(raval,decval,moon,minsep=None,maxillum=None):
+  up=moon['alt']>0
+  allowed=np.ones((len(raval),len(up)),dtype=bool)
+  if minsep is not None:
+    ra,dec=np.radians(raval),np.radians(decval)
+    starvec=np.stack([np.cos(dec)*np.cos(ra),np.cos(dec)*np.sin(ra),np.sin(dec)],axis=1)
+    allowed=((starvec@moon['vec'])<=np.cos(np.radians(minsep)))|~up[None,:]
+  if maxillum is not None:
+    allowed&=~(up&(moon['illum']>maxillum))[None,:]
+  return allowed
+
+# Creating a function which turns a ragged structure (offsets + values) into a fixed width float64 column of one row per star, padded with nan
+# The row of star i holds values[offsets[i]:offsets[i+1]] followed by nan, so it is written to FITS as a plain vector column (no per-row I/O)
+def padded_column(offsets,values):
+  counts=np.diff(offsets)
+  col=np.full((len(counts),max(int(counts.max()) if len(counts) else 0,1)),np.nan)
+  rows=np.repeat(np.arange(len(counts)),counts)
+  col[rows,np.arange(offsets[0],offsets[-1])-offsets[rows]]=values[offsets[0]:offsets[-1]]
+  return col
+
+###################################################################################################################################################################################
+
+# Creating a function which solves the visibility windows of every star analytically from its hour angle (fast visibility mode)
+# A star is above the threshold while its hour angle H satisfies |H| < H0, where cos(H0) = (sin(minalt)-sin(lat)sin(dec)) / (cos(lat)cos(dec))
+# Positions are taken as apparent (TETE) coordinates of date with the apparent sidereal time, so precession, nutation and aberration are included
+# ERROR BOUND: away from the refined cases the analytic crossing times agree with the exact AltAz transform to better than ~1 second,
+# so the returned time steps are identical to those of star_altitudes() + window_intervals() (the sampled path)
+# Stars culminating within margin (degrees) of the threshold are refined with the exact transform over the whole night; a crossing within tol
+# (seconds, the error bound) of a time step is settled by the exact altitude at that time step only
+# The windows are returned as the ragged structure of window_intervals()
+def analytic_window_intervals(raval,decval,times,location,minalt,margin=0.05,tol=1):
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+
+  offs=(times-times[0]).jd                                                     # Time steps in days since the first time step
+  rate=360.98564736629                                                         # Rate of change of the hour angle (degrees per day)
+
+  # Apparent coordinates at the middle of the time range, and the hour angle of every star at the first time step
+  app=sc(ra=raval*u.deg,dec=decval*u.deg,frame='icrs').transform_to(TETE(obstime=times[len(times)//2]))
+  lst=times[0].sidereal_time('apparent',longitude=location.lon).deg
+  hstart=(lst-app.ra.deg)%360
+
+  lat=location.lat.rad
+  dec=app.dec.rad
+  with np.errstate(divide='ignore',invalid='ignore'):
+    cosh0=(np.sin(np.radians(minalt))-np.sin(lat)*np.sin(dec))/(np.cos(lat)*np.cos(dec))
+  never=~(cosh0<1)                                                             # Stars whose highest altitude does not exceed the threshold
+  circum=cosh0<=-1                                                             # Stars whose lowest altitude stays above the threshold
+  h0=np.degrees(np.arccos(np.clip(cosh0,-1,1)))                                # Half of the hour angle range spent above the threshold
+
+  # x is the hour angle measured from the rising point; a star is above the threshold while x < 2*H0
+  # A star above the threshold at the first time step may set and rise again before the last one (a night is shorter than a sidereal day)
+  x0=(hstart+h0)%360
+  up=x0<2*h0
+  trise=np.where(up,0,(360-x0)/rate)
+  tset=np.where(up,(2*h0-x0)/rate,trise+(2*h0/rate))
+  trise2=np.where(up,tset+(360-2*h0)/rate,np.inf)
+  tset2=trise2+(2*h0/rate)
+
+  # Stars whose highest or lowest altitude lies close to the threshold, where the crossing time is poorly determined
+  altmax=90-np.degrees(np.abs(lat-dec))
+  altmin=np.degrees(np.abs(lat+dec))-90
+  refine=(np.abs(altmax-minalt)<margin)|(np.abs(altmin-minalt)<margin)
+
+  # Stars crossing the threshold within tol seconds before the first time step, whose state at that step is uncertain
+  tprev=np.where(up,x0,x0-2*h0)/rate
+  refine|=~never&~circum&(tprev*86400<tol)
+
+  # The first time step strictly after each crossing, matching the sampled path (len(times) where the window is still open at the last step)
+  first=np.where(up,0,np.searchsorted(offs,trise,side='right'))
+  first[circum]=0
+  last=np.searchsorted(offs,tset,side='right')
+  last[circum]=len(offs)
+  second=np.searchsorted(offs,trise2,side='right')
+  secondlast=np.searchsorted(offs,tset2,side='right')
+
+  # Crossings falling within tol seconds of a time step, where the analytic error could shift the time step found: the exact altitude
+  # at that single time step decides whether the window starts (or ends) there or at the next step
+  fix=[]
+  for tcross,mask,idx,rising in ((trise,~up,first,True),(tset,np.ones(len(raval),dtype=bool),last,False),(trise2,up,second,True),(tset2,up,secondlast,False)):
+    k=np.clip(np.searchsorted(offs,tcross),1,len(offs)-1)
+    near=np.where(np.abs(offs[k]-tcross)<np.abs(offs[k-1]-tcross),k,k-1)
+    flag=np.flatnonzero(mask&~never&~circum&~refine&(np.abs(offs[near]-tcross)*86400<tol))
+    fix.append((idx,flag,near[flag],rising))
+  stars=np.concatenate([flag for idx,flag,steps,rising in fix])
+  if len(stars)>0:
+    steps=np.concatenate([steps for idx,flag,steps,rising in fix])
+    cood=sc(ra=raval[stars]*u.deg,dec=decval[stars]*u.deg,frame='icrs')
+    above=cood.transform_to(aa(obstime=times[steps],location=location)).alt.deg>minalt
+    pos=0
+    for idx,flag,steps,rising in fix:
+      idx[flag]=np.where(above[pos:pos+len(flag)]==rising,steps,steps+1)
+      pos+=len(flag)
+
+  # Collecting the non-empty windows of the stars solved analytically, then the windows of the refined stars from the exact transform
+  keep=~never&~refine
+  star=[np.flatnonzero(keep),np.flatnonzero(keep&~circum)]
+  start=[first[star[0]],second[star[1]]]
+  end=[last[star[0]],secondlast[star[1]]]
+
+  # Refining only the near-threshold stars with the exact transform over the whole night
+  if refine.any():
+    altmat=star_altitudes(raval[refine],decval[refine],aa(obstime=times,location=location))
+    offsets,rstart,rend=window_intervals(altmat,minalt)
+    star.append(np.repeat(np.flatnonzero(refine),np.diff(offsets)))
+    start.append(rstart)
+    end.append(rend)
+
+  star,start,end=np.concatenate(star),np.concatenate(start),np.concatenate(end)
+  valid=start<end                                                              # Windows falling between two time steps are not seen by the sampled path either
+  order=np.lexsort((start[valid],star[valid]))
+  return ragged_offsets(star[valid][order],len(raval)),start[valid][order],end[valid][order]
+
+###################################################################################################################################################################################
+
+# Creating a function which refines threshold crossings bracketed on a coarse time grid by bisecting only those brackets
+# lo and hi are the bracket ends (in days since ref), uphi tells whether each object is above the threshold at hi and
+# altfunc(times) returns the altitude of each bracketed object at its own time; the first instant after each crossing is returned within tol seconds
+def bisect_crossings(altfunc,ref,lo,hi,uphi,threshold,tol):
+  lo=np.array(lo,dtype=float)
+  hi=np.array(hi,dtype=float)
+
+  # Every iteration halves all the brackets at once using a single transform
+  while len(hi)>0 and np.max(hi-lo)*86400>tol:
+    mid=(lo+hi)/2
+    same=(altfunc(ref+mid*u.day)>threshold)==uphi                              # Objects having the same state at mid as at hi cross before mid
+    hi=np.where(same,mid,hi)
+    lo=np.where(same,lo,mid)
+
+  return hi
+
+###################################################################################################################################################################################
+
+# Creating a function which calculates the sunset and sunrise for a twilight altitude, for the 24 hours following obstime
+# The Sun's altitude is evaluated on a coarse grid (step in minutes) and the crossings are bisected to tol seconds
+# Sunset is the first instant with the Sun below the twilight altitude and sunrise the first instant above it after sunset (None if not found)
+# The Sun's altitude on the coarse grid is returned as well
+def sun_crossings(obstime,location,twilight,step=15,tol=1):
+  grid=np.linspace(0,1,round(1440/step)+1)
+  duration=obstime+(grid*u.day)
+  sunalt=(get_sun(duration).transform_to(aa(obstime=duration,location=location))).alt.value
+
+  # The sunset is the rise of the negated altitude above the negated twilight altitude, and the sunrise its following set
+  setk,risek=window_indices(-sunalt[None,:],-twilight)
+  altfunc=lambda times: get_sun(times).transform_to(aa(obstime=times,location=location)).alt.value
+
+  sunset,sunrise=None,None
+  if setk[0]>=0:
+    sunset=obstime
+    if setk[0]>0:
+      sunset=obstime+bisect_crossings(altfunc,obstime,grid[setk-1],grid[setk],np.array([False]),twilight,tol)[0]*u.day
+    if risek[0]>=0:
+      sunrise=obstime+bisect_crossings(altfunc,obstime,grid[risek-1],grid[risek],np.array([True]),twilight,tol)[0]*u.day
+
+  return sunset,sunrise,sunalt
+
+###################################################################################################################################################################################
+
+# Creating a function which returns the sunset, sunrise and Sun's altitude curve from the local ephemeris cache, computing and storing them on a miss
+# Entries are keyed by the location, date (obstime), twilight altitude, grid step and tolerance; the last value tells whether the cache was hit
+def cached_sun_crossings(obstime,location,twilight,step=15,tol=1):
+  lon,lat,height=location.to_geodetic()
+  key=cache_key('sun',lat.deg,lon.deg,height.to_value(u.m),obstime.isot,twilight,step,tol)
+
+  entry=cache_load('ephemeris',key)
+  if entry is not None:
+    # Instants are stored as two-part Julian dates (nan when not found) to keep full precision
+    crossings=[]
+    for name in ['sunset','sunrise']:
+      if np.isnan(entry[name][0]):
+        crossings.append(None)
+      else:
+        crossing=Time(entry[name][0],entry[name][1],format='jd',scale='utc')
+        crossing.format=obstime.format
+        crossings.append(crossing)
+    return crossings[0],crossings[1],entry['sunalt'],True
+
+  sunset,sunrise,sunalt=sun_crossings(obstime,location,twilight,step,tol)
+  stored={name:(np.array([val.jd1,val.jd2]) if val is not None else np.array([np.nan,np.nan])) for name,val in [('sunset',sunset),('sunrise',sunrise)]}
+  cache_store('ephemeris',key,EPHEMERIS_CACHE_BYTES,sunalt=sunalt,**stored)
+
+  return sunset,sunrise,sunalt,False
+
+###################################################################################################################################################################################
+
+# Creating a function which creates the night time range from sunset to sunrise, sampled at 1-minute intervals
+def night_grid(sunset,sunrise):
+  stdiff=max(2,round(((sunrise-sunset).jd)*1440)+1)                            # Rounding the value to ensure only integer count for np.linspace()
+  return sunset+(np.linspace(0,1,stdiff)*(sunrise-sunset))
+
+###################################################################################################################################################################################
+
+# Creating a function which calculates the visibility windows of all the stars (SEASON_STARS) for a single night (one task of the season planner)
+# Returns the sunset, sunrise and the start and end of the visibility window of every star as MJD, nan where not found
+def season_night(date,lat,lon,ele,twilight,minalt,tol):
+  raval,decval=SEASON_STARS
+  location=el(lat=lat*u.deg,lon=lon*u.deg,height=ele*u.m)
+  sunset,sunrise,sunalt,cached=cached_sun_crossings(Time(date+' 12:00',scale='utc'),location,twilight,tol=tol)
+
+  start=np.full(len(raval),np.nan)
+  end=np.full(len(raval),np.nan)
+  if sunset is None or sunrise is None:                                        # No night with the selected twilight (e.g., polar summer)
+    return np.nan,np.nan,start,end
+
+  stduration=night_grid(sunset,sunrise)
+  rise,setidx=window_indices(star_altitudes(raval,decval,aa(obstime=stduration,location=location)),minalt)
+
+  mjd=stduration.mjd
+  start[rise>=0]=mjd[rise[rise>=0]]
+  end[setidx>=0]=mjd[setidx[setidx>=0]]
+
+  return sunset.mjd,sunrise.mjd,start,end
+
+###################################################################################################################################################################################
+
+# Creating a function which calculates the visibility windows of all the stars for every night in dates (YYYY-MM-DD strings),
+# distributing the nights over a pool of worker processes
+# Returns per-night sunset and sunrise (MJD), and (stars x nights) matrices of window start and end (MJD) and duration (hours)
+# A window still open at sunrise is counted until sunrise for its duration
+def season_windows(raval,decval,dates,lat,lon,ele,twilight,minalt,tol=1,workers=None):
+  global SEASON_STARS
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+
+  sunsets=np.full(len(dates),np.nan)
+  sunrises=np.full(len(dates),np.nan)
+  start=np.full((len(raval),len(dates)),np.nan)
+  end=np.full((len(raval),len(dates)),np.nan)
+
+  tasks=[dates,[lat]*len(dates),[lon]*len(dates),[ele]*len(dates),[twilight]*len(dates),[minalt]*len(dates),[tol]*len(dates)]
+
+  # Worker processes are forked so that they inherit the session state, including the star positions (set before the pool starts), and each
+  # task only sends its date and site; where forking is unavailable the nights are computed in this process
+  SEASON_STARS=(raval,decval)
+  if workers!=1 and 'fork' in multiprocessing.get_all_start_methods():
+    pool=ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('fork'))
+    results=pool.map(season_night,*tasks)
+  else:
+    pool=None
+    results=map(season_night,*tasks)
+
+  try:
+    for k,result in enumerate(results):
+      sunsets[k],sunrises[k],start[:,k],end[:,k]=result
+      print(f"Night of {dates[k]} completed ({k+1}/{len(dates)}).")
+  finally:
+    if pool is not None:
+      pool.shutdown(cancel_futures=True)
+    SEASON_STARS=None
+
+  duration=(np.where(np.isnan(end),sunrises[None,:],end)-start)*24
+
+  return sunsets,sunrises,start,end,duration
+
+###################################################################################################################################################################################
+
+# Creating a function which finds the start and end instants of every visibility window of every star (adaptive visibility mode)
+# The altitudes are evaluated on a coarse grid (step in minutes) spanning the frame's time range, and only the brackets
+# containing a crossing are bisected to tol seconds; windows shorter than the coarse step may be missed
+# The windows are returned as the ragged structure of window_intervals(), with the start and end instants as offsets in days since
+# the first time step (end is nan where the window is still open at the last time step)
+def adaptive_window(raval,decval,times,location,minalt,step=15,tol=1):
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+
+  span=(times[-1]-times[0]).jd
+  grid=np.linspace(0,span,max(2,round(span*1440/step)+1))
+  altmat=star_altitudes(raval,decval,aa(obstime=times[0]+(grid*u.day),location=location))
+  offsets,rise,setidx=window_intervals(altmat,minalt)
+  star=np.repeat(np.arange(len(raval)),np.diff(offsets))
+
+  start=np.where(rise==0,0.0,np.nan)
+  end=np.full(len(setidx),np.nan)
+
+  # Bisecting the rise (uphi True) and set (uphi False) brackets of all the windows together
+  for idx,out,uphi,sel in ((rise,start,True,np.flatnonzero(rise>0)),(setidx,end,False,np.flatnonzero(setidx<len(grid)))):
+    cood=sc(ra=raval[star[sel]]*u.deg,dec=decval[star[sel]]*u.deg,frame='icrs')
+    altfunc=lambda tt: cood.transform_to(aa(obstime=tt,location=location)).alt.value
+    out[sel]=bisect_crossings(altfunc,times[0],grid[idx[sel]-1],grid[idx[sel]],np.full(len(sel),uphi),minalt,tol)
+
+  return offsets,start,end
+
+###################################################################################################################################################################################
+
+# Creating a function which finds every visibility window of the stars for the night time steps in the selected visibility mode
+# ('1' exact, '2' fast, '3' adaptive, '4' fast AltAz); in the exact and fast AltAz modes the altitudes are stored in the altitude grid out
+# (a float32 grid held in memory is allocated when out is None)
+# Returns the ragged windows with their start and end in MJD (the end is nan where the window is still open at the last time step)
+# constraints holds the (maxairmass, minsep, maxillum) limits, None for the limits not applied: the airmass limit raises the altitude threshold
+# in every mode, while the Moon separation (degrees) and illumination (fraction) limits, applied to the samples taken with the Moon above
+# the horizon, are only available in the exact and fast AltAz modes; a time step with the Moon up and illuminated beyond maxillum is excluded for every star
+# The Moon ephemeris of the time steps (see moon_ephemeris()) can be given as moon, so that it is not calculated again
+def night_windows(mode,raval,decval,times,location,minalt,tol=1,out=None,constraints=None,moon=None):
+  maxairmass,minsep,maxillum=constraints or (None,None,None)
+  if maxairmass:
+    minalt=max(minalt,airmass_altitude(maxairmass))
+
+  if mode in ('1','4'):
+    if out is None:
+      out=altitude_grid(len(raval),len(times))
+    if moon is None and (minsep is not None or maxillum is not None):
+      moon=moon_ephemeris(times,location)
+    terms=fast_altaz_terms(times,location) if mode=='4' else None
+    offsets,start,end=altitude_windows(raval,decval,aa(obstime=times,location=location),minalt,out,moon=moon,minsep=minsep,maxillum=maxillum,terms=terms)
+  elif mode=='2':
+    offsets,start,end=analytic_window_intervals(raval,decval,times,location,minalt)
+  else:
+    offsets,start,end=adaptive_window(raval,decval,times,location,minalt,tol=tol)
+    return offsets,times[0].mjd+start,times[0].mjd+end
+
+  mjd=times.mjd
+  return offsets,mjd[start],np.where(end<len(mjd),mjd[np.minimum(end,len(mjd)-1)],np.nan)
+
+# Creating a function which returns, for every new (RA, Dec) pair, the index of the same pair among the cached pairs (-1 if absent)
+def match_rows(cachedra,cacheddec,raval,decval):
+  cached=cachedra+1j*cacheddec                                                 # Complex numbers sort by real then imaginary part, i.e. by (RA, Dec)
+  new=raval+1j*decval
+  order=np.argsort(cached)
+  pos=np.minimum(np.searchsorted(cached[order],new),len(order)-1)
+  idx=order[pos]
+  return np.where(cached[idx]==new,idx,-1)
+
+# Creating a function which returns the flat indices (into the values of a ragged structure) of the entries of the selected rows, and their counts
+def ragged_select(offsets,rows):
+  counts=np.diff(offsets)[rows]
+  firsts=np.concatenate([[0],np.cumsum(counts)[:-1]])
+  return np.repeat(offsets[rows]-firsts,counts)+np.arange(counts.sum()),counts
+
+# Creating a function which serves night_windows() from the local visibility cache, with least recently used eviction by disk budget
+# Entries are keyed by the night (mode, site, time steps, threshold, tolerance, grid dtype, constraints) plus a hash of the RA/Dec columns; when no entry
+# matches the catalog exactly, the recent entries of the same night are searched for the rows they share with it (e.g., a catalog that
+# has grown) and only the remaining rows are computed
+# The remaining rows are computed in blocks of CHECKPOINT_ROWS, each written to a checkpoint under the same key as soon as it is finished,
+# so that a run which is interrupted (e.g., Ctrl-C) resumes from its last finished block when it is repeated; the checkpoint is
+# removed once the run completes
+# Returns the windows as night_windows() does, the number of rows served from the cache and the number of rows resumed from a checkpoint
+def cached_night_windows(mode,raval,decval,times,location,minalt,tol=1,out=None,constraints=None,moon=None):
+  grid=mode in ('1','4')                                                        # Modes keeping the altitude grid
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+  if grid and out is None:
+    out=altitude_grid(len(raval),len(times))
+  lon,lat,height=location.to_geodetic()
+  nightkey=cache_key('visibility',mode,lat.deg,lon.deg,height.to_value(u.m),times[0].isot,times[-1].isot,len(times),minalt,
+                     tol if mode=='3' else None,out.dtype if grid else None,constraints)
+  key=nightkey+'-'+hashlib.sha1(raval.tobytes()+decval.tobytes()).hexdigest()
+
+  # Candidate entries of the same night, most recently used first (only the exact entry if it exists)
+  folder=os.path.join(CACHE_DIR,'visibility')
+  try:
+    names=[name[:-4] for name in os.listdir(folder) if name.startswith(nightkey+'-') and name.endswith('.npz')]
+    names.sort(key=lambda name: os.path.getmtime(os.path.join(folder,name+'.npz')),reverse=True)
+  except OSError:
+    names=[]
+  if key in names:
+    names=[key]
+
+  # The candidates are compared by their positions only, the altitude grid (modes 1 and 4) being opened memory-mapped for the chosen entry
+  idx=np.full(len(raval),-1)
+  entry=None
+  for name in names[:3]:
+    candidate=cache_load('visibility',name)
+    if candidate is None:
+      continue
+    candidx=match_rows(candidate['ra'],candidate['dec'],raval,decval)
+    if np.count_nonzero(candidx>=0)>np.count_nonzero(idx>=0):
+      idx,entry,chosen=candidx,candidate,name
+      if name==key:
+        break
+  if grid and entry is not None:
+    altgrid=cache_grid('visibility',chosen)
+    if altgrid is None or altgrid.shape!=(len(entry['ra']),out.shape[1]):      # An entry without its grid is not reused
+      idx[:]=-1
+
+  reused=np.flatnonzero(idx>=0)
+  fresh=np.flatnonzero(idx<0)
+  star,start,end=[],[],[]
+
+  if len(reused)>0:
+    flat,counts=ragged_select(entry['offsets'],idx[reused])
+    star.append(np.repeat(reused,counts))
+    start.append(entry['start'][flat])
+    end.append(entry['end'][flat])
+    if grid:
+      for first in range(0,len(reused),CHECKPOINT_ROWS):                        # Copied in blocks of rows, so that the grid is never held whole
+        part=reused[first:first+CHECKPOINT_ROWS]
+        out[part]=altgrid[idx[part]]
+
+  # Blocks finished by an interrupted run of the same night and catalog are taken from its checkpoint, in the order they were written
+  ckkind=os.path.join('checkpoint',key)
+  resumed=0
+  while len(fresh)>0:
+    block=cache_load(ckkind,f'block{resumed:06d}')
+    if block is None or not np.isin(block['rows'],fresh).all():               # A checkpoint of other rows (e.g., the cache changed) is not resumed
+      break
+    rows=block['rows']
+    blockalt=cache_grid(ckkind,f'block{resumed:06d}') if grid else None
+    if grid and (blockalt is None or blockalt.shape!=(len(rows),out.shape[1])):
+      break
+    star.append(np.repeat(rows,np.diff(block['offsets'])))
+    start.append(block['start'])
+    end.append(block['end'])
+    if grid:
+      out[rows]=blockalt
+    fresh=np.setdiff1d(fresh,rows,assume_unique=True)
+    resumed+=1
+  nresumed=len(raval)-len(reused)-len(fresh)
+  checkpoint=len(fresh)>CHECKPOINT_ROWS                                         # A single block would gain nothing from a checkpoint
+
+  # The Moon ephemeris is calculated once for all the blocks
+  if grid and len(fresh)>0 and moon is None and constraints is not None and (constraints[1] is not None or constraints[2] is not None):
+    moon=moon_ephemeris(times,location)
+
+  for number,first in enumerate(range(0,len(fresh),CHECKPOINT_ROWS),start=resumed):
+    rows=fresh[first:first+CHECKPOINT_ROWS]
+    contiguous=rows[-1]-rows[0]==len(rows)-1
+    sub=(out[rows[0]:rows[-1]+1] if contiguous else altitude_grid(len(rows),len(times),out.dtype)) if grid else None
+    offsets,fstart,fend=night_windows(mode,raval[rows],decval[rows],times,location,minalt,tol,sub,constraints,moon)
+    star.append(np.repeat(rows,np.diff(offsets)))
+    start.append(fstart)
+    end.append(fend)
+    if grid and not contiguous:
+      out[rows]=sub
+    if checkpoint:
+      cache_store(ckkind,f'block{number:06d}',np.inf,grid=sub,rows=rows,offsets=offsets,start=fstart,end=fend)
+
+  star=np.concatenate(star)
+  order=np.argsort(star,kind='stable')                                         # Every star comes from a single source, so its windows stay in time order
+  offsets,start,end=ragged_offsets(star[order],len(raval)),np.concatenate(start)[order],np.concatenate(end)[order]
+
+  if len(fresh)>0 or names[:1]!=[key]:
+    cache_store('visibility',key,VISIBILITY_CACHE_BYTES,grid=out if grid else None,ra=raval,dec=decval,offsets=offsets,start=start,end=end)
+  shutil.rmtree(os.path.join(CACHE_DIR,ckkind),ignore_errors=True)
+
+  return offsets,start,end,len(reused),nresumed
+
+###################################################################################################################################################################################
+
+# Creating a function which finds the visibility windows of all the stars at several sites (locations) in a single pass over the catalog
+# The site-independent work is shared: every chunk of stars is transformed once to CIRS (precession, nutation, aberration) on the
+# common time grid, and each site then only applies its Earth rotation angle and latitude (agrees with the AltAz transform to ~0.5 arcsec)
+# nights holds the (first, last+1) time steps of each site's night; the window time steps (indices into times) are returned per site
+def multisite_window_indices(raval,decval,times,locations,nights,minalt,chunk=2000):
+  raval=np.asarray(raval,dtype=float)
+  decval=np.asarray(decval,dtype=float)
+
+  rises=[np.full(len(raval),-1) for loc in locations]
+  sets=[np.full(len(raval),-1) for loc in locations]
+  era=[times.earth_rotation_angle(loc.lon).rad for loc in locations]          # Local Earth rotation angle of each site for every time step
+
+  for start in range(0,len(raval),chunk):
+    stop=min(start+chunk,len(raval))
+    cirs=sc(ra=raval[start:stop,None]*u.deg,dec=decval[start:stop,None]*u.deg,frame='icrs').transform_to(CIRS(obstime=times))
+    cra,cdec=cirs.ra.rad,cirs.dec.rad
+
+    for k,loc in enumerate(locations):
+      first,last=nights[k]
+      if last-first<1:                                                         # No night at this site
+        continue
+      hour=era[k][None,first:last]-cra[:,first:last]
+      lat=loc.lat.rad
+      altmat=np.degrees(np.arcsin(np.sin(lat)*np.sin(cdec[:,first:last])+np.cos(lat)*np.cos(cdec[:,first:last])*np.cos(hour)))
+
+      rise,setidx=window_indices(altmat,minalt)
+      rises[k][start:stop]=np.where(rise>=0,rise+first,-1)
+      sets[k][start:stop]=np.where(setidx>=0,setidx+first,-1)
+
+  return rises,sets
+
+###################################################################################################################################################################################
+
+# Creating a function which counts, for every time step of a night, how many stars are above the threshold ("how many stars are up now")
+# The counts are built from the visibility windows (offsets, winstart, winend in MJD, a nan end meaning open until the end of the night)
+# as +1 / -1 steps at the time steps where each window opens and closes followed by a cumulative sum, so the altitude data is never read
+# If groups (one label per star) is given, the stars are counted per group; returns the group labels (None if not grouped) and the
+# (groups x times) counts, or the counts of all stars if not grouped
+def occupancy(offsets,winstart,winend,times,groups=None):
+  times=np.asarray(times,dtype=float)
+  n=len(times)
+  first=np.searchsorted(times,winstart,side='left')                            # First time step inside the window
+  last=np.searchsorted(times,np.where(np.isnan(winend),np.inf,winend),side='left')  # First time step after the window
+
+  if groups is None:
+    labels,ngroups,base=None,1,0
+  else:
+    labels,code=np.unique(np.asarray(groups),return_inverse=True)
+    ngroups=len(labels)
+    base=np.repeat(code.ravel(),np.diff(offsets))*(n+1)                         # Row of the group of the star of every window
+  steps=np.bincount(base+first,minlength=ngroups*(n+1))-np.bincount(base+last,minlength=ngroups*(n+1))
+  counts=np.cumsum(steps.reshape(ngroups,n+1)[:,:n],axis=1)
+
+  return (labels,counts) if groups is not None else (None,counts[0])
+
+###################################################################################################################################################################################
+
+# Creating a function which returns the earliest start (in MJD) not before t at which an exposure of exp days fits in one of the windows
+# (ws, we) of a target, or None if it fits in none of them
+def earliest_start(ws,we,t,exp):
+  for wstart,wend in zip(ws,we):
+    begin=max(t,wstart)
+    if begin+exp<=wend:
+      return begin
+  return None
+
+# Creating a function which orders the targets of a night into an observing plan maximizing the total priority of the observed targets
+# The targets' visibility windows are the ragged structure (offsets, winstart, winend) in MJD (a nan end meaning open until nightend),
+# exptime (seconds) and priority are per target, and a slew takes overhead + separation / rate seconds (rate in degrees per second)
+# A greedy pass repeatedly picks the target with the best priority per unit of time consumed (slew + wait + exposure) from the current
+# position; a local search then inserts the unobserved targets into the gaps of the plan, or swaps them for lower priority targets,
+# delaying the following targets only within their windows, until no move improves the plan or budget seconds have passed
+# Returns the plan (target indices, start and end in MJD), its objective value (total priority) and the runtimes of both solver stages
+def schedule_night(raval,decval,offsets,winstart,winend,nightstart,nightend,exptime,priority,rate=1.0,overhead=0.0,budget=5.0):
+  ra,dec=np.radians(np.asarray(raval,dtype=float)),np.radians(np.asarray(decval,dtype=float))
+  vec=np.stack([np.cos(dec)*np.cos(ra),np.cos(dec)*np.sin(ra),np.sin(dec)],axis=1)
+  exp=np.broadcast_to(np.asarray(exptime,dtype=float)/86400,len(ra)).copy()
+  prio=np.broadcast_to(np.asarray(priority,dtype=float),len(ra)).copy()
+  wstar=np.repeat(np.arange(len(ra)),np.diff(offsets))
+  ws=np.maximum(winstart,nightstart)
+  we=np.minimum(np.where(np.isnan(winend),nightend,winend),nightend)
+
+  # Slew time (in days) from one target to a set of targets
+  def slew(frm,to):
+    if frm is None:
+      return np.zeros(np.shape(to))
+    return (overhead+np.degrees(np.arccos(np.clip(vec[to]@vec[frm],-1,1)))/rate)/86400
+
+  # Greedy pass over all the windows at once
+  clock=datetime.now()
+  done=np.zeros(len(ra),dtype=bool)
+  plan,starts,ends=[],[],[]
+  t,pos=nightstart,None
+  while True:
+    begin=np.maximum(t+slew(pos,wstar),ws)
+    fin=begin+exp[wstar]
+    ok=(fin<=we)&~done[wstar]&(prio[wstar]>0)
+    if not ok.any():
+      break
+    k=np.argmax(np.where(ok,prio[wstar]/(fin-t),-np.inf))
+    plan.append(wstar[k])
+    starts.append(begin[k])
+    ends.append(fin[k])
+    done[wstar[k]]=True
+    t,pos=fin[k],wstar[k]
+  greedytime=(datetime.now()-clock).total_seconds()
+
+  # Local search: insertion of unobserved targets into the plan, or their swap for a target of the plan with a lower priority
+  # (or the same priority but a longer occupation, which frees time for later insertions); the plan is kept as early as possible
+  clock=datetime.now()
+  windows=[(ws[offsets[i]:offsets[i+1]],we[offsets[i]:offsets[i+1]]) for i in range(len(ra))]
+
+  # Re-timing the whole plan as early as possible; also returns by how much each target could be delayed without breaking the plan (slack)
+  # and the slew time from each target to the next one (0 after the last)
+  def retime(plan):
+    starts,latest=np.empty(len(plan)),np.empty(len(plan))
+    t,pos=nightstart,None
+    for j,v in enumerate(plan):
+      begin=earliest_start(*windows[v],t+slew(pos,v),exp[v])
+      starts[j]=begin
+      latest[j]=windows[v][1][np.searchsorted(windows[v][0],begin,side='right')-1]-exp[v]    # Latest start within the window used
+      t,pos=begin+exp[v],v
+    ends=starts+exp[plan]
+    pairs=np.append((overhead+np.degrees(np.arccos(np.clip(np.sum(vec[plan[:-1]]*vec[plan[1:]],axis=1),-1,1)))/rate)/86400,0)
+    slack=latest-starts
+    idle=starts[1:]-(ends[:-1]+pairs[:-1])                                     # Waiting time before each target (after the first)
+    for j in range(len(plan)-2,-1,-1):
+      slack[j]=min(slack[j],idle[j]+slack[j+1])
+    return starts,ends,slack,pairs
+
+  plan=np.array(plan,dtype=int)
+  improved=len(plan)>0                                                         # An empty greedy plan means no target fits in the night at all
+  if improved:
+    starts,ends,slack,pairs=retime(plan)
+  while improved and (datetime.now()-clock).total_seconds()<budget:
+    improved=False
+    for cand in np.argsort(-prio,kind='stable'):
+      if done[cand] or prio[cand]<=0 or len(windows[cand][0])==0:
+        continue
+      if (datetime.now()-clock).total_seconds()>=budget:
+        break
+
+      # Candidate positions k (cand placed right after plan[k-1]): those whose preceding target ends while a window of cand is open
+      first=np.searchsorted(ends,windows[cand][0][0],side='left')
+      last=np.searchsorted(ends,windows[cand][1][-1]-exp[cand],side='right')
+      k=np.arange(first,min(last,len(plan))+1)
+      before=np.maximum(k-1,0)
+      prev=np.where(k>0,ends[before]+slew(cand,plan[before]),nightstart)
+      begin=np.full(len(k),np.inf)
+      for wstart,wend in zip(*windows[cand]):
+        b=np.maximum(prev,wstart)
+        begin=np.where(np.isinf(begin)&(b+exp[cand]<=wend),b,begin)
+      fin=begin+exp[cand]
+
+      # Insertion before plan[k]: the delay caused to plan[k] must fit in its slack
+      nxt=np.minimum(k,len(plan)-1)
+      delay=np.where(k<len(plan),fin+slew(cand,plan[nxt])-starts[nxt],0)
+      ok=np.isfinite(begin)&(delay<=np.where(k<len(plan),slack[nxt],np.inf)+1e-12)
+      if ok.any():
+        plan=np.insert(plan,k[np.argmax(ok)],cand)
+        done[cand]=True
+        starts,ends,slack,pairs=retime(plan)
+        improved=True
+        continue
+
+      # Swap of plan[k] for cand: the delay caused to plan[k+1] must fit in its slack
+      inplan=k<len(plan)
+      k,begin,fin=k[inplan],begin[inplan],fin[inplan]
+      nxt=np.minimum(k+1,len(plan)-1)
+      free=np.where(k+1<len(plan),fin+slew(cand,plan[nxt]),fin)               # Time at which the next target can start after cand
+      better=(prio[plan[k]]<prio[cand])|((prio[plan[k]]==prio[cand])&(free<ends[k]+pairs[k]-1/86400))
+      ok=np.isfinite(begin)&better&(np.where(k+1<len(plan),free-starts[nxt],0)<=np.where(k+1<len(plan),slack[nxt],np.inf)+1e-12)
+      if ok.any():
+        pos=k[np.argmax(ok)]
+        done[plan[pos]]=False
+        plan[pos]=cand
+        done[cand]=True
+        starts,ends,slack,pairs=retime(plan)
+        improved=True
+  searchtime=(datetime.now()-clock).total_seconds()
+
+  return plan,np.asarray(starts,dtype=float),np.asarray(ends,dtype=float),prio[plan].sum(),greedytime,searchtime
+
+###################################################################################################################################################################################
+
+# Initializing stars_alt here to ensure it always exists (the (stars x times) altitude grid of the last exact visibility run, None if not generated)
+stars_alt = None
+last_windows = None    # Visibility windows of the last visibility window run (used by the night schedule optimizer), None if not generated
+
+# Streaming mode: a pipeline of filters, derived quantities and coordinate conversions is built on the first block (which validates every step)
+# and then run over the whole catalog block by block; the session ends when the user leaves the streaming menu
+if streaming:
+  steps=[]
+  sample=readtable
+  while True:
+    print(":::::::::::::::::::::::::  STREAMING MENU  :::::::::::::::::::::::::",end='\n\n')
+    print("1. Add a Filter              -  Keep the rows satisfying a condition on a column.")
+    print("2. Add a Derived Quantity    -  Parallax, absolute magnitude, luminosity, distance or color index.")
+    print("3. Add a Coordinate Conversion  -  ICRS to Galactic, Galactic to ICRS or ICRS to AltAz.")
+    print("4. Run the Pipeline          -  Apply the steps to every block and save the result to a new .csv file.")
+    print("5. Exit                      -  Terminate the session.",end='\n\n')
+    if steps:
+      print(f"Current pipeline ({len(steps)} step(s)): "+' -> '.join(str(step[:2]) for step in steps),end='\n\n')
+    print('*************************************************************************************************************************************************',end='\n\n')
+
+    chsp=input("Enter a valid choice from the streaming menu: ").strip()
+    print('\n')
+
+    # Every step is tried on the first block, so that a wrong column name or type is reported before the catalog is read
+    step=None
+    if chsp=='1':
+      col=input("Enter the name of the column which has to be used as a filter: ")
+      print('\n')
+      if col not in sample.colnames:
+        print(f"The column {col} provided does not exist in the file {fname} !!!",end='\n\n')
+      elif sample[col].dtype.kind in 'US':
+        step=('filter',col,'==',input("Enter the EXACT string to filter rows based on the selected column: "))
+      elif sample[col].dtype.kind in 'iuf':
+        cond=input("Enter the filter condition ('>', '<', '==' or 'range'): ").strip()
+        if cond=='range':
+          step=('filter',col,cond,(only_num("Enter the minimum value for the comparison range: ",'float'),only_num("Enter the maximum value for the comparison range: ",'float')))
+        elif cond in ['>','<','==']:
+          step=('filter',col,cond,only_num("Enter the value to be used for comparison: ",'float'))
+        else:
+          print("INVALID choice for filtering condition !!!",end='\n\n')
+      else:
+        print("Comparison is ONLY available for columns having EITHER STRING OR NUMERIC data type !!!",end='\n\n')
+
+    elif chsp=='2':
+      needs={'parallax':['distance'],'absmag':['apparent magnitude','parallax'],'luminosity':['absolute magnitude'],'distance':['parallax'],'color':['first band','second band']}
+      quantity=input("Enter the quantity to derive ('parallax', 'absmag', 'luminosity', 'distance' or 'color'): ").strip()
+      if quantity in needs:
+        cols=tuple(input(f"Enter the name of the column consisting of the values for {need}: ") for need in needs[quantity])
+        missing=[col for col in cols if col not in sample.colnames or sample[col].dtype.kind not in 'iuf']
+        if missing:
+          print(f"The column {missing[0]} provided does not exist in the file {fname} or does not have a numeric data type !!!",end='\n\n')
+        else:
+          step=('derive',quantity,cols,input("Provide a name for the new column consisting of the derived values: "))
+      else:
+        print("INVALID choice for derived quantity !!!",end='\n\n')
+
+    elif chsp=='3':
+      kind=input("Enter the conversion ('icrs-galactic', 'galactic-icrs' or 'icrs-altaz'): ").strip()
+      if kind in ['icrs-galactic','galactic-icrs','icrs-altaz']:
+        cols=(input("Enter the name of the column consisting of the first coordinate (RA or l, in degrees): "),
+              input("Enter the name of the column consisting of the second coordinate (Dec or b, in degrees): "))
+        missing=[col for col in cols if col not in sample.colnames or sample[col].dtype.kind not in 'iuf']
+        if missing:
+          print(f"The column {missing[0]} provided does not exist in the file {fname} or does not have a numeric data type !!!",end='\n\n')
+        else:
+          where=(None,0,0,0)
+          if kind=='icrs-altaz':
+            while True:
+              try:
+                obstime=Time(datetime.strptime(input("Enter custom UTC date & time (format: YYYY-MM-DD HH:MM:SS): "),"%Y-%m-%d %H:%M:%S"),scale='utc')
+                break
+              except ValueError:
+                print("The date and time provided is NOT in the correct format !!! Please try again !!!",end='\n\n')
+            sitename,sitelat,sitelon,siteele=ask_site(1)
+            where=(obstime,sitelat,sitelon,siteele)
+            if input("If you want to use the FAST AltAz mode (~0.2 arcsec), type (y / Y / yes / YES): ") in ['y','Y','yes','YES']:
+              kind='fast-'+kind
+          newcols=(input("Enter a name for the column that would contain the first converted coordinate: "),
+                   input("Enter a name for the column that would contain the second converted coordinate: "))
+          step=('convert',kind,cols,newcols,where)
+      else:
+        print("INVALID choice for coordinate conversion !!!",end='\n\n')
+
+    elif chsp=='4':
+      if not steps:
+        print("The pipeline is EMPTY !!! Please add at least one step first.",end='\n\n')
+        continue
+      outname=input("Enter a name for the new .csv file where the result should be saved: ").strip()
+      print('\n')
+      if not outname.lower().endswith('.csv') or os.path.abspath(outname)==os.path.abspath(fname):
+        print("ERROR: The result MUST be saved to a NEW .csv file (the catalog itself is never overwritten) !!!",end='\n\n')
+        continue
+      try:
+        nread,nwritten,runtime=stream_csv(fname,outname,steps,names=usecols)
+      except ValueError as err:
+        print(f"ERROR: {err}",end='\n\n')
+        continue
+      print('\n')
+      print(f"The pipeline processed {nread} rows in {runtime:.1f} s; {nwritten} rows have been saved to {outname} !!!",end='\n\n')
+      print('*************************************************************************************************************************************************',end='\n\n')
+      steps=[]
+      sample=readtable
+      continue
+
+    elif chsp=='5':
+      print("Your session has been TERMINATED !!!",end='\n\n')
+      print('*************************************************************************************************************************************************',end='\n\n')
+      exit()
+
+    else:
+      print("INVALID choice from Streaming Menu !!! Please enter a VALID choice !!!",end='\n\n')
+      continue
+
+    if step is not None:
+      try:
+        sample=apply_step(sample.copy(),step)
+        steps.append(step)
+        print('\n')
+        display("The first block after this step is: ",sample)
+      except Exception as err:                                                   # e.g., an invalid value in the first block
+        print(f"ERROR: The step could not be applied to the first block ({err}) !!!",end='\n\n')
+    print('*************************************************************************************************************************************************',end='\n\n')
 
 # Start of SCOPE
 while True:
@@ -978,48 +2733,10 @@ while True:
         print('*************************************************************************************************************************************************',end='\n\n')
         continue
 
-#####################################################################################################################################################################################
-
-    # Creating a function which would verify that all the values in a column for a given table are in the range of [0,360)
-    def inrange360(table,col):
-      global err360
-      try:
-        index=0                           # Defining index and val variables
-        val=0
-        for i in range (len(table)):
-          if not 0<=table[col][i]<360:
-            index=i                       # The first encounter of out of range value will be recorded by the predefined variables index and val
-            val=table[col][i]             # A value error will be raised
-            raise ValueError
-      except ValueError:
-        print(f"The value at row no. {index} for the column {col} provided, was found to be {val} which is not in the range [0°,360°) !!!")
-        err360=1                          # The variable err360 is made to point to 1 in case of an error
-
-#####################################################################################################################################################################################
-
-    # Creating a function which would verify that all the values in a column for a given table are in the range of [-90,90]
-    def inrange90(table,col):
-      global err90
-      try:
-        index=0
-        val=0
-        for i in range (len(table)):
-          if not -90<=table[col][i]<=90:
-            index=i
-            val=table[col][i]
-            raise ValueError
-      except ValueError:
-        print(f"The value at row no. {index} for the column {col} provided was found to be {val} which is not in the range [-90°, +90°] !!!")
-        err90=1                           # The variable err90 is made to point to 1 in case of an error
-
 #####################################################################################################################################################################################
 
     loop=0
     while True:
-      # Assigning both err360 and err90, 0 after each loop to ensure smooth error detection
-      err360=0
-      err90=0
-
       if loop!=0:
         print("The program will now return back to the Observation Planner Menu !!!",end='\n\n')
 
@@ -1056,26 +2773,23 @@ while True:
 
         if (ra in plantable.colnames) and (dec in plantable.colnames) and (isinstance(plantable[ra][0],(float,np.floating))) and (isinstance(plantable[dec][0],(float,np.floating))):
 
-          # Checking whether each column has all the values in the expected range using inrange360() and inrange90()
-          inrange360(plantable,ra)
-          inrange90(plantable,dec)
+          # Checking whether each column has all the values in the expected range using inrange360() and inrange90() (whole column checks)
+          rangecheck=[inrange360(plantable,ra),inrange90(plantable,dec)]
 
-          # If an out of range value is detected for any of the column the err360/err90 would point towards 1
-          # If out of both any one or both the values point towards 1
-          if err360==1 or err90==1:
+          # If an out of range value is detected in any one or both of the columns
+          if any(result['count'] for result in rangecheck):
             continue                                                            # The program would return back to the observational planner menu
 
           # Asking user for the name of the columns consisting if the galactic inclination and declination values
           lcol=input("Enter a name for the column that would contain the galactic longitude values: ")
           bcol=input("Enter a name for the column that would contain the galacic latitude values: ")
 
-          # Creating AstroPy ICRS coordinates from the data available
-          cood=sc(ra=plantable[ra]*u.deg,dec=plantable[dec]*u.deg,frame='icrs')
-          newcood=cood.transform_to('galactic')                                 # Converting them to Galactic coordinates
+          # Converting ICRS to Galactic coordinates in row blocks with the cached rotation matrix (a fixed rotation, verified against AstroPy)
+          lval,bval=convert_columns('icrs-galactic',plantable[ra],plantable[dec])
 
           # Appending the transformed values to the copy table
-          plantable[lcol]=newcood.l.value
-          plantable[bcol]=newcood.b.value
+          put_column(plantable,lcol,lval)
+          put_column(plantable,bcol,bval)
 
           display("The updated table containing the galactic latitudes and longitudes is: ",plantable)
           save(plantable)
@@ -1100,20 +2814,19 @@ while True:
 
         if (l in plantable.colnames) and (b in plantable.colnames) and (isinstance(plantable[l][0],(float,np.floating))) and (isinstance(plantable[b][0],(float,np.floating))):
 
-          inrange360(plantable,l)
-          inrange90(plantable,b)
+          rangecheck=[inrange360(plantable,l),inrange90(plantable,b)]
 
-          if err360==1 or err90==1:
+          if any(result['count'] for result in rangecheck):
             continue
 
           racol=input("Enter a name for the column that would contain the right ascension values: ")
           deccol=input("Enter a name for the column that would contain the declination values: ")
 
-          cood=sc(l=plantable[l]*u.deg,b=plantable[b]*u.deg,frame='galactic')
-          newcood=cood.transform_to('icrs')
+          # The Galactic to ICRS rotation is the transpose of the cached ICRS to Galactic rotation matrix
+          raval,decval=convert_columns('galactic-icrs',plantable[l],plantable[b])
 
-          plantable[racol]=newcood.ra.value
-          plantable[deccol]=newcood.dec.value
+          put_column(plantable,racol,raval)
+          put_column(plantable,deccol,decval)
 
           display("The updated table containing the right ascension and declination values is: ",plantable)
           save(plantable)
@@ -1138,10 +2851,9 @@ while True:
 
         if (ra in plantable.colnames) and (dec in plantable.colnames) and (isinstance(plantable[ra][0],(float,np.floating))) and (isinstance(plantable[dec][0],(float,np.floating))):
 
-          inrange360(plantable,ra)
-          inrange90(plantable,dec)
+          rangecheck=[inrange360(plantable,ra),inrange90(plantable,dec)]
 
-          if err360==1 or err90==1:
+          if any(result['count'] for result in rangecheck):
             continue
 
           # Asking user to enter date and time at which the AltAz coordinates have to be calculated
@@ -1157,17 +2869,17 @@ while True:
               print('*************************************************************************************************************************************************',end='\n\n')
               continue
 
+          # Optionally moving the positions from the catalog epoch to the observation date
+          raval,decval=epoch_positions(plantable,ra,dec,obstime)
+
           altcol=input("Enter a name for the column that would contain the altitude values: ")
           azcol=input("Enter a name for the column that would contain the azimuth values: ")
 
-          cood=sc(ra=plantable[ra]*u.deg,dec=plantable[dec]*u.deg,frame='icrs')
-          location=el(lat=lat*u.deg,lon=lon*u.deg,height=ele*u.m)               # Creating the earth location of the user
-
-          aaf=aa(obstime=obstime,location=location)                             # Creating the AltAz frame of the user
-          newcood=cood.transform_to(aaf)
+          # Converting to the AltAz frame of the user in row blocks distributed over the worker processes
+          altval,azval=altaz_conversion('icrs-altaz',raval,decval,obstime,lat,lon,ele)
 
-          plantable[altcol]=newcood.alt.value
-          plantable[azcol]=newcood.az.value
+          put_column(plantable,altcol,altval)
+          put_column(plantable,azcol,azval)
 
           display("The updated table containing the altitude and azimuth values is: ",plantable)
           save(plantable)
@@ -1192,10 +2904,9 @@ while True:
 
         if (altcol in plantable.colnames) and (azcol in plantable.colnames) and (isinstance(plantable[altcol][0],(float,np.floating))) and (isinstance(plantable[azcol][0],(float,np.floating))):
 
-          inrange360(plantable,azcol)
-          inrange90(plantable,altcol)
+          rangecheck=[inrange360(plantable,azcol),inrange90(plantable,altcol)]
 
-          if err360==1 or err90==1:
+          if any(result['count'] for result in rangecheck):
             continue
 
           while True:
@@ -1213,13 +2924,10 @@ while True:
           racol=input("Enter a name for the column that would contain the right ascension values: ")
           deccol=input("Enter a name for the column that would contain the declination values: ")
 
-          location=el(lat=lat*u.deg,lon=lon*u.deg,height=ele*u.m)
-          cood=sc(alt=plantable[altcol]*u.deg,az=plantable[azcol]*u.deg,frame='altaz',obstime=obstime,location=location)
+          raval,decval=altaz_conversion('altaz-icrs',plantable[altcol],plantable[azcol],obstime,lat,lon,ele)
 
-          newcood=cood.transform_to('icrs')
-
-          plantable[racol]=newcood.ra.value
-          plantable[deccol]=newcood.dec.value
+          put_column(plantable,racol,raval)
+          put_column(plantable,deccol,decval)
 
           display("The updated table containing the right ascension and declination values is: ",plantable)
           save(plantable)
@@ -1244,10 +2952,9 @@ while True:
 
         if (l in plantable.colnames) and (b in plantable.colnames) and (isinstance(plantable[l][0],(float,np.floating))) and (isinstance(plantable[b][0],(float,np.floating))):
 
-          inrange360(plantable,l)
-          inrange90(plantable,b)
+          rangecheck=[inrange360(plantable,l),inrange90(plantable,b)]
 
-          if err360==1 or err90==1:
+          if any(result['count'] for result in rangecheck):
             continue
 
           while True:
@@ -1262,14 +2969,10 @@ while True:
               print('*************************************************************************************************************************************************',end='\n\n')
               continue
 
-          cood=sc(l=plantable[l]*u.deg,b=plantable[b]*u.deg,frame='galactic')
-          location=el(lat=lat*u.deg,lon=lon*u.deg,height=ele*u.m)
-
-          aaf=aa(obstime=obstime,location=location)
-          newcood=cood.transform_to(aaf)
+          altval,azval=altaz_conversion('galactic-altaz',plantable[l],plantable[b],obstime,lat,lon,ele)
 
-          plantable[altcol]=newcood.alt.value
-          plantable[azcol]=newcood.az.value
+          put_column(plantable,altcol,altval)
+          put_column(plantable,azcol,azval)
 
           display("The updated table containing the altitude and azimuth values is: ",plantable)
           save(plantable)
@@ -1294,10 +2997,9 @@ while True:
 
         if (altcol in plantable.colnames) and (azcol in plantable.colnames) and (isinstance(plantable[altcol][0],(float,np.floating))) and (isinstance(plantable[azcol][0],(float,np.floating))):
 
-          inrange360(plantable,azcol)
-          inrange90(plantable,altcol)
+          rangecheck=[inrange360(plantable,azcol),inrange90(plantable,altcol)]
 
-          if err360==1 or err90==1:
+          if any(result['count'] for result in rangecheck):
             continue
 
           while True:
@@ -1315,13 +3017,10 @@ while True:
           lcol=input("Enter a name for the column that would contain the galactic longitude values: ")
           bcol=input("Enter a name for the column that would contain the galactic latitude values: ")
 
-          location=el(lat=lat*u.deg,lon=lon*u.deg,height=ele*u.m)
-          cood=sc(alt=plantable[altcol]*u.deg,az=plantable[azcol]*u.deg,frame='altaz',obstime=obstime,location=location)
+          lval,bval=altaz_conversion('altaz-galactic',plantable[altcol],plantable[azcol],obstime,lat,lon,ele)
 
-          newcood=cood.transform_to('galactic')
-
-          plantable[lcol]=newcood.l.value
-          plantable[bcol]=newcood.b.value
+          put_column(plantable,lcol,lval)
+          put_column(plantable,bcol,bval)
 
           display("The updated table containing the galactic latitude and longitude values is: ",plantable)
           save(plantable)
@@ -1344,13 +3043,16 @@ while True:
         print('*************************************************************************************************************************************************', end='\n\n')
         print("> Your catalog MUST contain ICRS (Right Ascension and Declination) columns.")
         print("> If your data uses GALACTIC coordinates, please CONVERT them to ICRS using the Coordinate Conversion Tool BEFORE proceeding.")
-        print("> Any unsupported option (not 1 or 2) will redirect you to the planner to allow coordinate conversion.", end='\n\n')
+        print("> Any unsupported option (not 1 to 5) will redirect you to the planner to allow coordinate conversion.", end='\n\n')
         print('*************************************************************************************************************************************************', end='\n\n')
 
         # Visibility Check & Window Menu
         print(":::::::::::::::::::::::::  VISIBILITY CHECK & WINDOW MENU  :::::::::::::::::::::::::",end='\n\n')
         print("1. Note on Visibility and the Procedure to Perform Visibility Check.")
-        print("2. Check Visibility Window.",end='\n\n')
+        print("2. Check Visibility Window.")
+        print("3. Check Season Visibility Windows (Multiple Nights).")
+        print("4. Check Visibility Windows at Multiple Sites.")
+        print("5. Plan the Night (Schedule Optimizer, uses the windows of option 2).",end='\n\n')
         print('*************************************************************************************************************************************************',end='\n\n')
 
         chvo=input("Enter a choice from the visibility check & window menu: ").strip()
@@ -1370,8 +3072,8 @@ while True:
 
         # If the user goes with the choice of checking visibility window
         elif chvo=='2':
-          # stars_alt is a global list to store the altitude values of each star for every minute of the full night duration (for plotting Altitude vs Time visibility curves)
-          stars_alt.clear()
+          # stars_alt is a global (stars x times) array storing the altitude values of each star for every minute of the full night duration (for plotting Altitude vs Time visibility curves)
+          stars_alt=None
 
           print("NOTE: VISIBILITY WINDOW", end='\n\n')
           print('*************************************************************************************************************************************************', end='\n\n')
@@ -1387,10 +3089,9 @@ while True:
 
           if (ra in plantable.colnames) and (dec in plantable.colnames) and (isinstance(plantable[ra][0],(float,np.floating))) and (isinstance(plantable[dec][0],(float,np.floating))):
 
-            inrange360(plantable,ra)
-            inrange90(plantable,dec)
+            rangecheck=[inrange360(plantable,ra),inrange90(plantable,dec)]
 
-            if err360==1 or err90==1:
+            if any(result['count'] for result in rangecheck):
               continue
 
             print("NOTE: STAR-WISE VISIBILITY WINDOW", end='\n\n')
@@ -1416,26 +3117,19 @@ while True:
                 print("Please enter the date in the correct format !!!",end='\n\n')
                 continue
 
+            # Optionally moving the positions from the catalog epoch to the observation date
+            raval,decval=epoch_positions(plantable,ra,dec,obstime)
+
             print("NOTE: TIME RESOLUTION POLICY",end='\n\n')
             print('*************************************************************************************************************************************************', end='\n\n')
-            print("> All visibility calculations are performed at a fixed 1-minute interval.")
-            print("> This resolution ensures sufficient temporal precision for detecting rising and setting events.")
-            print("> Second-level granularity is unnecessary, as stellar altitude evolves smoothly across time.")
-            print("> The fixed step also ensures consistent performance and avoids excessive computation.",end='\n\n')
+            print("> SUNSET and SUNRISE are located on a coarse 15-minute grid and then refined by bisection to a user-selected tolerance (in seconds).")
+            print("> In the EXACT, FAST and FAST ALTAZ visibility modes, star altitudes are evaluated at a fixed 1-minute interval.")
+            print("> In the ADAPTIVE visibility mode, star altitudes use the same coarse grid and bisection, giving sub-second crossing times.")
+            print("> Second-level granularity is rarely needed, as stellar altitude evolves smoothly across time.",end='\n\n')
             print('*************************************************************************************************************************************************', end='\n\n')
 
-            duration=obstime+(np.linspace(0,1,1440)*u.day)                      # The duration is chosen to be from 12 noon UTC of entered date to 12:00 noon UTC of next date
-                                                                                # 24 hours duration is assumed to calculate the surise and sunset time for the user's location
-
             # Creating earth location of the user
             location=el(lat=lat*u.deg,lon=lon*u.deg,height=ele*u.m)
-            aaf=aa(obstime=duration,location=location)                          # AltAz frame of user
-
-            sunalt=(get_sun(duration).transform_to(aaf)).alt.value              # Calculating and stroing Sun's altitude for all 1440 mins (24 hrs)
-
-            # Creating variables which would store the sunrise and sunset values according to the user's location
-            sunset=None
-            sunrise=None
 
             # Twilight Menu
             print(":::::::::::::::::::::::::  TWILIGHT MENU  :::::::::::::::::::::::::",end='\n\n')
@@ -1467,12 +3161,18 @@ while True:
               print("INVALID choice for twilight type !!! Defaulting to Astronomical Twilight (-18°).",end='\n\n')
               twilight=-18
 
-            # Calculating sunrise and sunset times for user's location
-            for i in range (len(sunalt)):
-              if sunalt[i]<twilight and sunset is None:
-                sunset=duration[i]
-              elif sunalt[i]>twilight and sunrise is None and sunset is not None:
-                sunrise=duration[i]
+            # Asking user for the tolerance of the bisection used for the crossing times, defaulting to 1 second if not positive
+            tol=only_num("Enter the tolerance (in seconds) for the sunset, sunrise and crossing times (e.g., 1): ",'float')
+            print('\n')
+            if not tol>0:
+              print("The tolerance entered was not positive !!! Defaulting to a tolerance of 1 second.",end='\n\n')
+              tol=1
+
+            # Calculating sunrise and sunset times for user's location from 12 noon UTC of entered date to 12:00 noon UTC of next date
+            # Repeated plans for the same date, location and twilight are served from the local ephemeris cache
+            sunset,sunrise,sunalt,cached=cached_sun_crossings(obstime,location,twilight,tol=tol)
+            if cached:
+              print(f"The sunset and sunrise times were LOADED from the local ephemeris cache ({CACHE_DIR}).",end='\n\n')
 
             print(f"The sunset time for your location coordinates (lat: {lat}°, lon: {lon}°, ele: {ele} m) for twilight {twilight}° was found to be: ",sunset)
             print(f"The sunrise time for your location coordinates (lat: {lat}°, lon: {lon}°, ele: {ele} m) for twilight {twilight}° was found to be: ",sunrise,end='\n\n')
@@ -1487,64 +3187,161 @@ while True:
             print('*************************************************************************************************************************************************', end='\n\n')
 
             # Asking user to enter the altitude threshold for the stars and making it global
-            # Ensuring that the value belongs to the expected range of [5,15]
             global minalt
-            try:
-              minalt=only_num("Enter a valid altitude threshold (in degrees) in the range [5°,15°]: ",'float')
-              print('\n')
-              if not 5<=minalt<=15:
-                raise ValueError
-            except ValueError:                                                  # In case of out of range, default value of 15° is assumed by the program
-              print(f"The altitude threshold entered was not in the valid range of [5°,15°] !!! Defaulting to the general use altitude threshold of 15°.",end='\n\n')
-              minalt=15
+            minalt=ask_minalt()
 
             print('*************************************************************************************************************************************************', end='\n\n')
-            print("Calculating star visibility window... This may take up to 1–2 minutes...",end='\n\n')
-            print('*************************************************************************************************************************************************', end='\n\n')
 
-            global stduration
-            stdiff=round(((sunrise-sunset).value)*1440)                         # Calculating the night time range for the observer's location for their custom date
-            stduration=sunset+(np.linspace(0,1,stdiff)*u.day)                   # Rounding the value to ensure only integer count for np.linspace()
+            # Visibility Mode Menu
+            print(":::::::::::::::::::::::::  VISIBILITY MODE MENU  :::::::::::::::::::::::::",end='\n\n')
+            print("1. Exact     -  Altitude of every star sampled at every time step (required for Altitude vs Time plots).")
+            print("2. Fast      -  Analytic hour-angle solution, refined with the exact transform only near the altitude threshold.")
+            print("3. Adaptive  -  Coarse 15-minute grid refined by bisection, giving crossing times within the selected tolerance.")
+            print("4. Fast AltAz - As Exact, with one precomputed precession-nutation and Earth rotation matrix per time step (~0.2 arcsec, much faster).",end='\n\n')
+            print('*************************************************************************************************************************************************',end='\n\n')
+
+            chvm=input("Enter your choice for visibility mode: ").strip()
+            print('\n')
+
+            # User goes with an invalid choice for visibility mode, the exact mode is assumed by the program
+            if chvm not in ['1','2','3','4']:
+              print("INVALID choice for visibility mode !!! Defaulting to the Exact mode.",end='\n\n')
+              chvm='1'
+
+            # Altitude Storage Menu (exact and fast AltAz modes only), for the altitude grid kept for the Altitude vs Time plots
+            if chvm in ['1','4']:
+              print('*************************************************************************************************************************************************', end='\n\n')
+              print(":::::::::::::::::::::::::  ALTITUDE STORAGE MENU  :::::::::::::::::::::::::",end='\n\n')
+              print("1. float64  -  Full precision (8 bytes per sample).")
+              print("2. float32  -  ~1e-5° precision (4 bytes per sample), recommended.")
+              print("3. float16  -  ~0.06° precision (2 bytes per sample), for very large catalogs.",end='\n\n')
+              print("> The visibility windows are always found from full precision altitudes; the storage type only affects the Altitude vs Time plots.",end='\n\n')
+              print('*************************************************************************************************************************************************',end='\n\n')
 
-            # AltAz frame of user for the night time range
-            aaf1=aa(obstime=stduration,location=location)
+              chst=input("Enter your choice for altitude storage: ").strip()
+              print('\n')
+              if chst not in ['1','2','3']:
+                print("INVALID choice for altitude storage !!! Defaulting to float32.",end='\n\n')
+                chst='2'
+              altdtype={'1':'float64','2':'float32','3':'float16'}[chst]
+
+              # Optionally backing the altitude grid by a NEW file on disk (memory map) instead of memory, the file being removed when the session ends
+              while True:
+                altpath=input("Enter a NEW file name to back the altitude grid on disk (e.g., altitudes.dat, deleted when the session ends), or press ENTER to keep it in memory: ").strip()
+                print('\n')
+                if altpath and os.path.exists(altpath) and altpath not in SCRATCH_FILES:
+                  print(f"ERROR: The file {altpath} already exists and would be OVERWRITTEN !!! Please enter another name !!!",end='\n\n')
+                  continue
+                break
 
-            ssr=np.full(len(plantable),np.nan,dtype=object)                     # List storing the starting time of the visibility window for all the stars
-            sst=np.full(len(plantable),np.nan,dtype=object)                     # List storing the ending time of the visibility window for all the stars
+            print('*************************************************************************************************************************************************', end='\n\n')
+            print("NOTE: AIRMASS AND MOON CONSTRAINTS", end='\n\n')
+            print("> A MAXIMUM AIRMASS (sec z) raises the altitude threshold; it is available in every visibility mode.")
+            print("> A MINIMUM MOON SEPARATION and a MAXIMUM MOON ILLUMINATION only apply while the Moon is above the horizon, and need the EXACT or FAST ALTAZ mode.")
+            print("> When the Moon is above the horizon and brighter than the maximum illumination, that time is excluded for EVERY star.",end='\n\n')
+            print('*************************************************************************************************************************************************', end='\n\n')
 
-            for i in range (len(plantable)):
-              # Creating variables raval and decval which would store the right ascension and declination value of a single star during each loop
-              raval=plantable[ra][i]
-              decval=plantable[dec][i]
+            # Asking user whether the airmass and Moon constraints have to be applied
+            constraints=moon=None
+            chcon=input("If you want to apply airmass / Moon constraints, type (y / Y / yes / YES): ")
+            print('\n')
+            if chcon in ['y','Y','yes','YES']:
+              maxairmass=only_num("Enter the maximum airmass (e.g., 2), or 0 for no limit: ",'float')
+              print('\n')
+              if not maxairmass>=1:                                            # The airmass is never below 1 (zenith)
+                if maxairmass!=0:
+                  print("The maximum airmass entered was below 1 !!! No airmass limit is applied.",end='\n\n')
+                maxairmass=None
+
+              minsep=maxillum=None
+              if chvm in ['1','4']:
+                minsep=only_num("Enter the minimum Moon separation (in degrees, e.g., 30), or 0 for no limit: ",'float')
+                while not 0<=minsep<=180:
+                  print("INVALID Moon separation !!! It must be between 0 and 180 degrees !!!",end='\n\n')
+                  minsep=only_num("Enter the minimum Moon separation (in degrees, e.g., 30), or 0 for no limit: ",'float')
+                maxillum=only_num("Enter the maximum Moon illumination (fraction in [0,1], e.g., 0.5), or 1 for no limit: ",'float')
+                while not 0<=maxillum<=1:
+                  print("INVALID Moon illumination !!! It must be a fraction between 0 and 1 !!!",end='\n\n')
+                  maxillum=only_num("Enter the maximum Moon illumination (fraction in [0,1], e.g., 0.5), or 1 for no limit: ",'float')
+                print('\n')
+                minsep=minsep if minsep>0 else None
+                maxillum=maxillum if maxillum<1 else None
+              else:
+                print("The Moon constraints need the EXACT or FAST ALTAZ visibility mode !!! Only the airmass limit is applied.",end='\n\n')
 
-              # Creating AstroPy coordinates of a single star in ICRS frame during each loop
-              cood=sc(ra=raval*u.deg,dec=decval*u.deg,frame='icrs')
-              stalt=(cood.transform_to(aaf1)).alt.value                         # Calculating the star's altitude for every minute for whole night time range
+              constraints=(maxairmass,minsep,maxillum)
+              if maxairmass:
+                print(f"The airmass limit of {maxairmass} corresponds to an altitude of {airmass_altitude(maxairmass):.2f}°.",end='\n\n')
+              if minsep is not None or maxillum is not None:
+                moon=moon_ephemeris(night_grid(sunset,sunrise),location)
+                print(f"During the night, the Moon is above the horizon {100*np.mean(moon['alt']>0):.0f}% of the time, with an illuminated fraction of "
+                      f"{moon['illum'].min():.2f} to {moon['illum'].max():.2f}.",end='\n\n')
 
-              stars_alt.append(stalt)
+            print('*************************************************************************************************************************************************', end='\n\n')
+            print("Calculating star visibility window... This may take up to 1–2 minutes...",end='\n\n')
+            print('*************************************************************************************************************************************************', end='\n\n')
 
-              # Variables that would store the start (stsr) and end (stst) time of the visibility window for a single star
-              stsr=None
-              stst=None
+            global stduration
+            stduration=night_grid(sunset,sunrise)                               # Calculating the night time range for the observer's location for their custom date
 
-              # Calculating the start and end time of visibility window for each star
-              for j in range (len(stalt)):
-                if stalt[j]>minalt and stsr is None:
-                  stsr=stduration[j]
-                  ssr[i]=stsr                                                   # Appeding the start time of visibility window of each and every star to ssr
-                elif stalt[j]<minalt and stsr is not None and stst is None:
-                  stst=stduration[j]
-                  sst[i]=stst                                                   # Appeding the end time of visibility window of each and every star to sst
+            # Every visibility window of every star is found, stored as a ragged structure (window offsets per star + window start/end in MJD)
+            # Exact mode: the altitudes of all the stars for every minute of the whole night are calculated chunk by chunk into the altitude grid
+            # Fast AltAz mode: as the exact mode, with the altitudes calculated from the rotations precomputed once per time step
+            # Fast mode: the windows are solved analytically; Adaptive mode: the crossings bracketed on a coarse grid are bisected (no altitude curves are stored)
+            if chvm in ['1','4']:
+              stars_alt=altitude_grid(len(plantable),len(stduration),altdtype,altpath)
 
+            # Rows already computed for the same night, site and thresholds are served from the local visibility cache
+            # Large runs are checkpointed block by block, so an interrupted run resumes where it stopped when it is repeated with the same inputs
+            try:
+              offsets,winstart,winend,nreused,nresumed=cached_night_windows(chvm,raval,decval,stduration,location,minalt,tol,stars_alt,constraints,moon)
+            except KeyboardInterrupt:
+              stars_alt=None
+              print('\n')
+              print("The visibility window calculation was INTERRUPTED !!!",end='\n\n')
+              print(f"> The finished blocks of {CHECKPOINT_ROWS} rows are kept in the local cache ({CACHE_DIR}).")
+              print("> Repeat this option with the SAME file, date, location and settings to RESUME from the last finished block.",end='\n\n')
+              print('*************************************************************************************************************************************************', end='\n\n')
+              continue
+            if nreused==len(plantable):
+              print(f"The visibility windows were LOADED from the local visibility cache ({CACHE_DIR}).",end='\n\n')
+            elif nreused>0:
+              print(f"The visibility windows of {nreused} rows were LOADED from the local visibility cache; {len(plantable)-nreused-nresumed} rows were computed.",end='\n\n')
+            if nresumed>0:
+              print(f"The visibility windows of {nresumed} rows were RESUMED from the checkpoint of an interrupted run.",end='\n\n')
+
+            # Keeping the windows of this run for the night schedule optimizer
+            last_windows={'ra':raval,'dec':decval,'offsets':offsets,'start':winstart,'end':winend,
+                          'times':stduration.mjd,'nightstart':stduration[0].mjd,'nightend':stduration[-1].mjd}
+
+            if chvm=='4':
+              maxerr,mederr=fast_altaz_accuracy(raval,decval,stduration,location)
+              print(f"FAST AltAz accuracy against the exact transform (random sample of stars above the horizon): largest error {maxerr:.3f} arcsec, median {mederr:.4f} arcsec.",end='\n\n')
+
+            if chvm in ['1','4'] and altpath:
+              stars_alt.flush()
+              print(f"The altitude grid ({stars_alt.shape[0]} x {stars_alt.shape[1]}, {altdtype}) is backed by the file {altpath} (deleted when the session ends).",end='\n\n')
+
+            # The first visibility window of each star is kept as the start and end time of its visibility window (nan if the star is never visible)
+            visible=np.diff(offsets)>0
+            ssr=np.full(len(plantable),np.nan)
+            sst=np.full(len(plantable),np.nan)
+            ssr[visible]=winstart[offsets[:-1][visible]]
+            sst[visible]=winend[offsets[:-1][visible]]
 
             # Asking user to enter the name of the columns that would contain the start and end time of the visibility window for all stars
             stsrcol=input("Enter the name of the new column consisting of starting value for the visibility window: ")
             ststcol=input("Enter the name of the column consisting of ending value for the visibility window: ")
             print('\n')
 
-            # Appending the columns to the copy table
-            plantable[stsrcol]=ssr
-            plantable[ststcol]=sst
+            # Appending the columns to the copy table, along with the start and end (MJD) of all the visibility windows of each star
+            put_mjd_column(plantable,stsrcol,ssr)
+            put_mjd_column(plantable,ststcol,sst)
+            plantable[stsrcol+'_N']=np.diff(offsets)
+            put_mjd_column(plantable,stsrcol+'_All',padded_column(offsets,winstart))
+            put_mjd_column(plantable,ststcol+'_All',padded_column(offsets,winend))
+            print(f"The columns {stsrcol}_All and {ststcol}_All hold the start and end (MJD) of EVERY visibility window of each star ({len(winstart)} windows in total).",end='\n\n')
+            print(f"Only the first {stsrcol}_N values of a row are windows; the rest of the row is nan padding.",end='\n\n')
 
             display("The updated table consisting of the starting and ending value for the visibility window is: ",plantable)
             print("NOTE:")
@@ -1556,8 +3353,249 @@ while True:
             print("*************************************************************************************************************************************************", end='\n\n')
             print("NOTE: SESSION CONTINUITY FOR ALTITUDE-TIME PLOTTING", end='\n\n')
             print('*************************************************************************************************************************************************', end='\n\n')
-            print("If you intend to visualize Altitude vs Time curves, do NOT terminate the session after this, as visibility context will be lost.", end='\n\n')
+            print("If you intend to visualize Altitude vs Time curves, do NOT terminate the session after this, as visibility context will be lost.")
+            print("Altitude vs Time curves are ONLY available after a visibility window computed in the EXACT or FAST ALTAZ mode.", end='\n\n')
+            print('*************************************************************************************************************************************************', end='\n\n')
+
+          else:
+            if ra not in plantable.colnames:
+              print(f"The column {ra} provided does not exist in the file {fname} !!!",end='\n\n')
+            elif dec not in plantable.colnames:
+              print(f"The column {dec} provided does not exist in the file {fname} !!!",end='\n\n')
+            elif not isinstance(plantable[ra][0],(float,np.floating)):
+              print(f"The column {ra} provided does not have a numeric data type !!!",end='\n\n')
+            else:
+              print(f"The column {dec} provided does not have a numeric data type !!!",end='\n\n')
+
+        # If the user goes with the choice of checking visibility windows over a season (multiple consecutive nights)
+        elif chvo=='3':
+          print("NOTE: SEASON VISIBILITY WINDOWS", end='\n\n')
+          print('*************************************************************************************************************************************************', end='\n\n')
+          print("> This feature computes the visibility window of EACH STAR for EVERY NIGHT of a season (e.g., a proposal semester).")
+          print("> Each night is computed like the Check Visibility Window option (EXACT mode), and the nights are distributed over several CPU cores.")
+          print("> The result holds, for every star, one value per night for the window START, END (in MJD) and DURATION (in hours).")
+          print("> As each such column holds one value per night, the result can ONLY be saved as a .fits file.", end='\n\n')
+          print('*************************************************************************************************************************************************', end='\n\n')
+
+          ra=input("Enter the name of the column consisting of right ascension values (0° ≤ RA < 360°): ")
+          dec=input("Enter the name of the column consisting of declination values (-90° ≤ DEC ≤ +90°): ")
+          print('\n')
+
+          if (ra in plantable.colnames) and (dec in plantable.colnames) and (isinstance(plantable[ra][0],(float,np.floating))) and (isinstance(plantable[dec][0],(float,np.floating))):
+
+            rangecheck=[inrange360(plantable,ra),inrange90(plantable,dec)]
+
+            if any(result['count'] for result in rangecheck):
+              continue
+
+            # Asking user to enter the date of the first night of the season
+            while True:
+              try:
+                indate=input("Enter the date of the FIRST night of the season (format: YYYY-MM-DD): ")
+                print('\n')
+                indateeval=datetime.strptime(indate,"%Y-%m-%d")
+                break
+              except ValueError:
+                print("INVALID date format !!!")
+                print("Please enter the date in the correct format !!!",end='\n\n')
+                continue
+
+            # Asking user for the number of nights and the number of worker processes
+            while True:
+              nights=only_num("Enter the number of nights in the season (e.g., 180): ",'int')
+              if nights>0:
+                break
+              print("The number of nights MUST be a POSITIVE integer !!! Please try again !!!",end='\n\n')
+
+            workers=only_num(f"Enter the number of worker processes (1 to {os.cpu_count()}, 0 for all cores): ",'int')
+            print('\n')
+            if not 0<workers<=os.cpu_count():
+              workers=os.cpu_count()
+
+            # Optionally moving the positions from the catalog epoch to the middle of the season
+            raval,decval=epoch_positions(plantable,ra,dec,Time(indate+' 12:00',scale='utc')+(nights/2)*u.day)
+
+            # Twilight Menu
+            print(":::::::::::::::::::::::::  TWILIGHT MENU  :::::::::::::::::::::::::",end='\n\n')
+            print("Choose twilight type for sunrise/sunset determination:-",end='\n\n')
+            print("1. Official     (Sun at 0°)  -  Visible Sun")
+            print("2. Civil        (-6°)        -  General outdoor visibility")
+            print("3. Nautical     (-12°)       -  Horizon barely visible")
+            print("4. Astronomical (-18°)       -  TRUE darkness (recommended for astronomy)",end='\n\n')
+            print('*************************************************************************************************************************************************',end='\n\n')
+
+            chtw=input("Enter your choice for twilight type: ").strip()
+            print('\n')
+            print('*************************************************************************************************************************************************',end='\n\n')
+
+            twilight={'1':0,'2':-6,'3':-12,'4':-18}.get(chtw)
+            if twilight is None:
+              print("INVALID choice for twilight type !!! Defaulting to Astronomical Twilight (-18°).",end='\n\n')
+              twilight=-18
+
+            minalt=ask_minalt()
+
+            print('*************************************************************************************************************************************************', end='\n\n')
+            print(f"Calculating star visibility windows for {nights} nights using {workers} worker process(es)...",end='\n\n')
+            print('*************************************************************************************************************************************************', end='\n\n')
+
+            dates=[(indateeval+timedelta(days=k)).strftime("%Y-%m-%d") for k in range(nights)]
+            sunsets,sunrises,wstart,wend,wdur=season_windows(raval,decval,dates,lat,lon,ele,twilight,minalt,workers=workers)
+            print('\n')
+
+            # Asking user for the prefix of the new columns, which hold one value per night
+            prefix=input("Enter a prefix for the new columns (e.g., Season): ")
+            print('\n')
+
+            put_mjd_column(plantable,prefix+'_Start',wstart)
+            put_mjd_column(plantable,prefix+'_End',wend)
+            plantable[prefix+'_Duration']=wdur.astype(np.float32)
+            plantable[prefix+'_Duration'].unit='h'
+
+            # Recording the season in the table metadata (the k-th value of each column belongs to the k-th night)
+            plantable.meta['FIRSTNGT']=dates[0]
+            plantable.meta['NNIGHTS']=nights
+            plantable.meta['TWILIGHT']=twilight
+            plantable.meta['MINALT']=minalt
+
+            display("The updated table consisting of the season visibility windows (one value per night) is: ",plantable)
+
+            # Saving the season table (only .fits files support one value per night in a single column)
+            while True:
+              fname_season=input("Please enter a name for the .fits file where the season table should be saved: ")
+              print('\n')
+              if not fname_season.lower().endswith('.fits'):
+                print("ERROR: The season table can ONLY be saved to a .fits file !!!",end='\n\n')
+                continue
+              plantable.write(fname_season,format='fits',overwrite=True)
+              print(f"The season table has been saved to {fname_season} !!!",end='\n\n')
+              break
+
+          else:
+            if ra not in plantable.colnames:
+              print(f"The column {ra} provided does not exist in the file {fname} !!!",end='\n\n')
+            elif dec not in plantable.colnames:
+              print(f"The column {dec} provided does not exist in the file {fname} !!!",end='\n\n')
+            elif not isinstance(plantable[ra][0],(float,np.floating)):
+              print(f"The column {ra} provided does not have a numeric data type !!!",end='\n\n')
+            else:
+              print(f"The column {dec} provided does not have a numeric data type !!!",end='\n\n')
+
+        # If the user goes with the choice of checking visibility windows at several observing sites in a single run
+        elif chvo=='4':
+          print("NOTE: MULTI-SITE VISIBILITY WINDOWS", end='\n\n')
+          print('*************************************************************************************************************************************************', end='\n\n')
+          print("> This feature computes the visibility window of EACH STAR at SEVERAL OBSERVING SITES for the same date, in a single run.")
+          print("> The location entered at the start of the planner is the FIRST site; you will be asked for the ADDITIONAL sites.")
+          print("> Work common to all sites (coordinate setup, time grid, precession and nutation) is performed ONCE and shared.")
+          print("> Each site gets its own START and END columns, using a common 1-minute UTC grid (accuracy of about half an arcsecond in altitude).", end='\n\n')
+          print('*************************************************************************************************************************************************', end='\n\n')
+
+          ra=input("Enter the name of the column consisting of right ascension values (0° ≤ RA < 360°): ")
+          dec=input("Enter the name of the column consisting of declination values (-90° ≤ DEC ≤ +90°): ")
+          print('\n')
+
+          if (ra in plantable.colnames) and (dec in plantable.colnames) and (isinstance(plantable[ra][0],(float,np.floating))) and (isinstance(plantable[dec][0],(float,np.floating))):
+
+            rangecheck=[inrange360(plantable,ra),inrange90(plantable,dec)]
+
+            if any(result['count'] for result in rangecheck):
+              continue
+
+            # Asking user for the name of the first site (the planner's location) and for the additional sites
+            sites=[(input("Enter a short name for the site entered at the start of the planner (used as prefix of its columns): ").strip(),lat,lon,ele)]
+            while True:
+              nsites=only_num("Enter the number of ADDITIONAL sites: ",'int')
+              if nsites>0:
+                break
+              print("The number of additional sites MUST be a POSITIVE integer !!! Please try again !!!",end='\n\n')
+            print('\n')
+
+            for k in range(nsites):
+              sites.append(ask_site(k+2))
+
+            while True:
+              try:
+                indate=input("Enter custom date when you want to start performing stellar observation (format: YYYY-MM-DD): ")
+                print('\n')
+                indateeval=datetime.strptime(indate,"%Y-%m-%d")
+                obstime=Time(indate+' 12:00',scale='utc')
+                break
+              except ValueError:
+                print("INVALID date format !!!")
+                print("Please enter the date in the correct format !!!",end='\n\n')
+                continue
+
+            # Optionally moving the positions from the catalog epoch to the observation date
+            raval,decval=epoch_positions(plantable,ra,dec,obstime)
+
+            # Twilight Menu
+            print(":::::::::::::::::::::::::  TWILIGHT MENU  :::::::::::::::::::::::::",end='\n\n')
+            print("Choose twilight type for sunrise/sunset determination:-",end='\n\n')
+            print("1. Official     (Sun at 0°)  -  Visible Sun")
+            print("2. Civil        (-6°)        -  General outdoor visibility")
+            print("3. Nautical     (-12°)       -  Horizon barely visible")
+            print("4. Astronomical (-18°)       -  TRUE darkness (recommended for astronomy)",end='\n\n')
+            print('*************************************************************************************************************************************************',end='\n\n')
+
+            chtw=input("Enter your choice for twilight type: ").strip()
+            print('\n')
+            print('*************************************************************************************************************************************************',end='\n\n')
+
+            twilight={'1':0,'2':-6,'3':-12,'4':-18}.get(chtw)
+            if twilight is None:
+              print("INVALID choice for twilight type !!! Defaulting to Astronomical Twilight (-18°).",end='\n\n')
+              twilight=-18
+
+            minalt=ask_minalt()
+
+            # Calculating the sunset and sunrise of every site (the only site-dependent solar work)
+            locations=[el(lat=slat*u.deg,lon=slon*u.deg,height=sele*u.m) for sname,slat,slon,sele in sites]
+            sunsets,sunrises=[],[]
+            for (sname,slat,slon,sele),location in zip(sites,locations):
+              sunset,sunrise,sunalt,cached=cached_sun_crossings(obstime,location,twilight)
+              print(f"Site {sname} (lat: {slat}°, lon: {slon}°, ele: {sele} m): sunset at {sunset}, sunrise at {sunrise}.")
+              sunsets.append(sunset)
+              sunrises.append(sunrise)
+            print('\n')
+
+            # Common 1-minute UTC grid from the earliest sunset to the latest sunrise, and the time steps of each site's night on it
+            valid=[k for k in range(len(sites)) if sunsets[k] is not None and sunrises[k] is not None]
+            nights=[(0,0)]*len(sites)
+            if valid:
+              gstart=min(sunsets[k] for k in valid)
+              steps=int(np.ceil(max((sunrises[k]-gstart).jd for k in valid)*1440))+1
+              grid=gstart+(np.arange(steps)/1440)*u.day
+              for k in valid:
+                nights[k]=(int(np.ceil((sunsets[k]-gstart).jd*1440)),int(np.floor((sunrises[k]-gstart).jd*1440))+1)
+            for k in range(len(sites)):
+              if k not in valid:
+                print(f"NOTE: No night was found at site {sites[k][0]} for twilight {twilight}° !!! Its columns will be empty.",end='\n\n')
+
+            print('*************************************************************************************************************************************************', end='\n\n')
+            print(f"Calculating star visibility windows at {len(sites)} sites...",end='\n\n')
+            print('*************************************************************************************************************************************************', end='\n\n')
+
+            if valid:
+              rises,sets=multisite_window_indices(raval,decval,grid,locations,nights,minalt)
+              gridmjd=grid.mjd
+
+            # Appending the start and end of the visibility window at every site to the copy table
+            for k,(sname,slat,slon,sele) in enumerate(sites):
+              ssr=np.full(len(plantable),np.nan)
+              sst=np.full(len(plantable),np.nan)
+              if k in valid:
+                ssr[rises[k]>=0]=gridmjd[rises[k][rises[k]>=0]]
+                sst[sets[k]>=0]=gridmjd[sets[k][sets[k]>=0]]
+              put_mjd_column(plantable,sname+'_Start',ssr)
+              put_mjd_column(plantable,sname+'_End',sst)
+
+            display("The updated table consisting of the starting and ending value for the visibility window at every site is: ",plantable)
+            print("NOTE:")
+            print('*************************************************************************************************************************************************', end='\n\n')
+            print("Empty or 'nan' values indicate stars that did not rise above the selected altitude at that site on the given date !!!",end='\n\n')
             print('*************************************************************************************************************************************************', end='\n\n')
+            save(plantable)
 
           else:
             if ra not in plantable.colnames:
@@ -1569,6 +3607,89 @@ while True:
             else:
               print(f"The column {dec} provided does not have a numeric data type !!!",end='\n\n')
 
+        # If the user goes with the choice of planning the night from the visibility windows of option 2
+        elif chvo=='5':
+          if last_windows is None or len(last_windows['ra'])!=len(plantable):
+            print("ACCESS DENIED: Visibility Windows Not Found", end='\n\n')
+            print('*************************************************************************************************************************************************',end='\n\n')
+            print("> The schedule optimizer requires the visibility windows of the current catalog, which have not been generated in this session.")
+            print("> Please select 'Check Visibility Window' (option 2) from this menu first, then return here to plan the night.",end='\n\n')
+            print('*************************************************************************************************************************************************',end='\n\n')
+            continue
+
+          print("NOTE: NIGHT SCHEDULE OPTIMIZER", end='\n\n')
+          print('*************************************************************************************************************************************************', end='\n\n')
+          print("> The optimizer orders the targets of the last visibility window run into a plan that MAXIMIZES the TOTAL PRIORITY of the observed targets.")
+          print("> Every target is observed once, for its exposure time, entirely inside one of its visibility windows.")
+          print("> A slew between two targets takes an OVERHEAD (settling, readout) plus the angular separation divided by the SLEW RATE.")
+          print("> A GREEDY plan is built first and then improved by a LOCAL SEARCH (insertions and swaps) within a time budget.",end='\n\n')
+          print('*************************************************************************************************************************************************', end='\n\n')
+
+          # Asking user for the exposure times and priorities, either as columns of the table or as a single value for all the targets
+          perrow={}
+          for name,unit,default in [('exposure times','in seconds',None),('priorities','higher is more important',1.0)]:
+            while True:
+              val=input(f"Enter the column name holding the {name} ({unit}), or a single value for all the targets"+(f" (ENTER for {default}): " if default else ": ")).strip()
+              if val=='' and default is not None:
+                perrow[name]=np.full(len(plantable),default)
+                break
+              if val in plantable.colnames and plantable[val].dtype.kind in 'iuf':
+                perrow[name]=np.ma.filled(np.ma.asarray(plantable[val],dtype=float),0)
+                break
+              try:
+                perrow[name]=np.full(len(plantable),float(val))
+                break
+              except ValueError:
+                print(f"{val} is neither a numeric column of the table nor a number !!! Please try again !!!",end='\n\n')
+          print('\n')
+
+          if not (perrow['exposure times']>0).all():
+            print("The exposure times MUST be positive !!! Targets with a non-positive exposure time are NOT scheduled.",end='\n\n')
+            perrow['priorities']=np.where(perrow['exposure times']>0,perrow['priorities'],0)
+            perrow['exposure times']=np.where(perrow['exposure times']>0,perrow['exposure times'],1)
+
+          rate=only_num("Enter the slew rate of the telescope (in degrees per second, e.g., 2): ",'float')
+          overhead=only_num("Enter the overhead per target (in seconds, e.g., 30 for settling and readout): ",'float')
+          budget=only_num("Enter the time budget of the local search (in seconds, e.g., 5): ",'float')
+          print('\n')
+          if not rate>0:
+            print("The slew rate entered was not positive !!! Defaulting to 1 degree per second.",end='\n\n')
+            rate=1.0
+          overhead=max(overhead,0)
+          budget=max(budget,0)
+
+          print('*************************************************************************************************************************************************', end='\n\n')
+          print("Planning the night...",end='\n\n')
+
+          plan,pstart,pend,objective,greedytime,searchtime=schedule_night(last_windows['ra'],last_windows['dec'],last_windows['offsets'],last_windows['start'],
+                                                                           last_windows['end'],last_windows['nightstart'],last_windows['nightend'],
+                                                                           perrow['exposure times'],perrow['priorities'],rate,overhead,budget)
+
+          print(f"Targets scheduled: {len(plan)} of {len(plantable)}")
+          print(f"Objective value (total priority of the scheduled targets): {objective:g}")
+          if len(plan)>0:
+            busy=(pend-pstart).sum()/(last_windows['nightend']-last_windows['nightstart'])
+            print(f"Night used for exposures: {100*busy:.1f}% (the rest being slews, overheads and waits)")
+          print(f"Solver runtime: {greedytime:.3f} s (greedy) + {searchtime:.3f} s (local search)",end='\n\n')
+          print('*************************************************************************************************************************************************', end='\n\n')
+
+          # Asking user for the prefix of the new columns, holding the position of each target in the plan and its start and end (MJD)
+          prefix=input("Enter a prefix for the new columns (e.g., Plan): ")
+          print('\n')
+
+          order=np.zeros(len(plantable),dtype=int)                             # 0 for the targets that are not scheduled
+          order[plan]=np.arange(1,len(plan)+1)
+          ostart=np.full(len(plantable),np.nan)
+          oend=np.full(len(plantable),np.nan)
+          ostart[plan]=pstart
+          oend[plan]=pend
+          put_column(plantable,prefix+'_Order',order)
+          put_mjd_column(plantable,prefix+'_Start',ostart)
+          put_mjd_column(plantable,prefix+'_End',oend)
+
+          display("The updated table consisting of the night plan (order 0 means not scheduled) is: ",plantable)
+          save(plantable)
+
         # If the user chooses an invalid choice from the visibility check & window menu
         else:
           print("INVALID choice from visibility check & window menu !!!",end='\n\n')
@@ -1680,7 +3801,8 @@ while True:
       print("2. Column Histogram    -  Visualize Distribution of a Quantity")
       print("3. Category Bar Graph  -  Frequency of a Non-Numeric Column")
       print("4. Altitude vs Time    -  Track Visibility Throughout the Night")
-      print("5. Exit Visualization Menu")
+      print("5. Targets Up vs Time  -  How Many Stars Are Above the Altitude Limit")
+      print("6. Exit Visualization Menu")
       print('****************************************************************************************************************************************',end='\n\n')
 
       vizch=input("Enter your choice from the visualization menu: ").strip()
@@ -1875,7 +3997,7 @@ while True:
       # If the user wants to plot an altitude vs time graph
       elif vizch=='4':
         # Block access if visibility data is missing and guide user to run visibility window first
-        if not stars_alt:
+        if stars_alt is None:
           print("ACCESS DENIED: Visibility Data Not Found", end='\n\n')
           print('****************************************************************************************************************************************',end='\n\n')
           print("> Altitude vs Time plotting requires visibility data, which has not been generated in this session.")
@@ -1967,11 +4089,11 @@ while True:
           # Plot all stars using auto color cycle and labels from the selected column
           if nplot=='all':
             for i in range(len(readtable)):
-              plt.plot(stduration.to_datetime(),stars_alt[i],label=readtable[labelcol][i])
+              plt.plot(stduration.to_datetime(),np.asarray(stars_alt[i],dtype=float),label=readtable[labelcol][i])
           # Plot only selected stars using their row indices
           else:
             for i in starch:
-              plt.plot(stduration.to_datetime(),stars_alt[i],label=readtable[labelcol][i])
+              plt.plot(stduration.to_datetime(),np.asarray(stars_alt[i],dtype=float),label=readtable[labelcol][i])
 
           plt.xticks(rotation=45)
           plt.title(ptitle)
@@ -1991,8 +4113,74 @@ while True:
 
 ##################################################################################################################################################################################
 
-      # If the user chooses to return back to the main menu
+      # If the user wants to plot how many stars are above the altitude threshold at each time step of the night
       elif vizch=='5':
+        # Block access if the visibility windows are missing and guide user to run visibility window first
+        if last_windows is None or len(last_windows['ra'])!=len(readtable):
+          print("ACCESS DENIED: Visibility Windows Not Found", end='\n\n')
+          print('****************************************************************************************************************************************',end='\n\n')
+          print("> The Targets Up vs Time plot requires the visibility windows of this catalog, which have not been generated in this session.")
+          print("> To proceed, exit the Visualization Menu and return to the Main Menu.")
+          print("> Then open the Observational Planner and select: 'Visibility (Check and) Window (Full Night Range)'.")
+          print("> After running the above tool (in either visibility mode), return here to plot the number of targets up.",end='\n\n')
+          print('****************************************************************************************************************************************',end='\n\n')
+          continue
+
+        wtimes=Time(last_windows['times'],format='mjd',scale='utc')
+        print("SETTINGS: Targets Up vs Time – ACADEMIC DEFAULTS APPLIED", end='\n\n')
+        print(f"> X-AXIS: Night-time UTC range ({wtimes[0].iso} to {wtimes[-1].iso}) | Y-AXIS: Number of stars above the altitude threshold")
+        print("> LINE STYLE: Steps | GRID: ON | LEGEND: Group labels (if grouped)")
+        print(f"> If grouped, the {OCCUPANCY_GROUPS-1} largest groups are drawn and the rest are summed as 'Other'", end='\n\n')
+        print('****************************************************************************************************************************************',end='\n\n')
+
+        # Asking user for an optional column to group the stars by
+        grpcol=input("Enter the column name to group the stars by (e.g., Spectral_Type), or press ENTER for no grouping: ").strip()
+        print('\n')
+
+        if grpcol and grpcol not in readtable.colnames:
+          print(f"The column {grpcol} provided does not exist in the file {fname} !!!",end='\n\n')
+          continue
+
+        groups=None
+        if grpcol:
+          groups=readtable[grpcol]
+          groups=np.ma.filled(groups,'') if groups.dtype.kind in 'US' else np.ma.filled(groups,np.nan)
+        labels,counts=occupancy(last_windows['offsets'],last_windows['start'],last_windows['end'],last_windows['times'],groups)
+
+        total=counts if labels is None else counts.sum(axis=0)
+        peak=int(np.argmax(total))
+        print(f"At most {total[peak]} of {len(readtable)} stars are up at the same time (at {wtimes[peak].iso} UTC).",end='\n\n')
+
+        common(0)
+
+        if labels is None:
+          plt.step(wtimes.to_datetime(),counts,where='post',color='slategray')
+        else:
+          # Keeping the largest groups (by peak count) and summing the remaining ones as 'Other'
+          order=np.argsort(counts.max(axis=1))[::-1]
+          if len(order)>OCCUPANCY_GROUPS:
+            keep,rest=order[:OCCUPANCY_GROUPS-1],order[OCCUPANCY_GROUPS-1:]
+          else:
+            keep,rest=order,order[:0]
+          for i in keep:
+            plt.step(wtimes.to_datetime(),counts[i],where='post',label=str(labels[i]))
+          if len(rest)>0:
+            plt.step(wtimes.to_datetime(),counts[rest].sum(axis=0),where='post',label='Other')
+          plt.step(wtimes.to_datetime(),total,where='post',color='black',linestyle='--',linewidth=0.8,label='All')
+          plt.legend()
+
+        plt.xticks(rotation=45)
+        plt.title(ptitle)
+        plt.xlabel(xlabel)
+        plt.ylabel(ylabel)
+        plt.grid(True)
+
+        saveshow(0)
+
+##################################################################################################################################################################################
+
+      # If the user chooses to return back to the main menu
+      elif vizch=='6':
         print("The program would RETURN BACK to MAIN MENU.")
         vizsure=input("If you want to continue with visualization process, type (y / Y / yes / YES): ")
         print('\n')
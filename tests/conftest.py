@@ -0,0 +1,30 @@
+# SCOPE.py is an interactive script, so the tests load only its imports, constants (upper case names), functions and classes,
+# without running the session
+import ast
+import os
+import sys
+import types
+
+import pytest
+
+SCOPE_PATH=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'SCOPE.py')
+
+# Creating a function which tells whether a top level statement of SCOPE.py is a definition (kept) or part of the session (skipped)
+def definition(node):
+  if isinstance(node,(ast.Import,ast.ImportFrom,ast.FunctionDef,ast.ClassDef)):
+    return True
+  if isinstance(node,ast.Try):                                                  # Optional imports
+    return all(isinstance(stmt,(ast.Import,ast.ImportFrom)) for stmt in node.body)
+  if isinstance(node,ast.Assign):
+    return all(isinstance(target,ast.Name) and target.id.isupper() for target in node.targets)
+  return False
+
+@pytest.fixture(scope='session')
+def scope():
+  with open(SCOPE_PATH) as f:
+    tree=ast.parse(f.read())
+  module=types.ModuleType('scope')
+  module.__file__=SCOPE_PATH
+  sys.modules['scope']=module                                                   # Lets the worker pools pickle the functions
+  exec(compile(ast.Module(body=[node for node in tree.body if definition(node)],type_ignores=[]),SCOPE_PATH,'exec'),module.__dict__)
+  return module
@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from astropy.table import Column, MaskedColumn, Table
+from astropy.time import Time
+
+
+# Writing a small .csv catalog
+def write_csv(path,lines):
+  path.write_text('\n'.join(lines)+'\n')
+  return str(path)
+
+
+def test_occupancy_counts_windows_per_time_step(scope):
+  times=np.arange(6,dtype=float)
+  offsets=np.array([0,2,3,3])                                                   # Star 0: two windows, star 1: one (open), star 2: none
+  winstart=np.array([0.5,3.0,2.0])
+  winend=np.array([2.0,4.0,np.nan])
+  labels,counts=scope.occupancy(offsets,winstart,winend,times)
+  assert labels is None
+  np.testing.assert_array_equal(counts,[0,1,1,2,1,1])
+
+  labels,counts=scope.occupancy(offsets,winstart,winend,times,groups=['B','A','B'])
+  np.testing.assert_array_equal(labels,['A','B'])
+  np.testing.assert_array_equal(counts,[[0,0,1,1,1,1],[0,1,0,1,0,0]])
+
+
+def test_propagate_epoch_agrees_with_apply_space_motion(scope):
+  rng=np.random.default_rng(1)
+  n=200
+  ra=rng.uniform(0,360,n)
+  dec=np.degrees(np.arcsin(rng.uniform(-0.99,0.99,n)))
+  pmra=rng.uniform(-200,200,n)
+  pmdec=rng.uniform(-200,200,n)
+  rv=rng.uniform(-100,100,n)
+  dist=rng.uniform(5,300,n)
+  dt=25.0
+
+  newra,newdec=scope.propagate_epoch(ra,dec,pmra,pmdec,dt,rv=rv,dist=dist,chunk=64)
+  star=SkyCoord(ra=ra*u.deg,dec=dec*u.deg,pm_ra_cosdec=pmra*u.mas/u.yr,pm_dec=pmdec*u.mas/u.yr,
+                radial_velocity=rv*u.km/u.s,distance=dist*u.pc,obstime=Time('J2000'))
+  moved=star.apply_space_motion(dt=dt*u.yr)
+  sep=SkyCoord(ra=newra*u.deg,dec=newdec*u.deg).separation(SkyCoord(ra=moved.ra,dec=moved.dec)).to_value(u.mas)
+  assert sep.max()<0.01                                                        # The radial velocity alone moves these stars by up to ~0.7 mas
+  assert ((newra>=0)&(newra<360)).all()
+
+
+def test_csv_blocks_widens_types_across_blocks(scope,tmp_path):
+  fname=write_csv(tmp_path/'cat.csv',['id,mag,note','1,5,','2,6,','3,6.5,a','4,7,b'])
+  blocks=list(scope.csv_blocks(fname,rows=2))
+  assert len(blocks)==2
+  assert blocks[0]['id'].dtype.kind=='i'
+  assert blocks[1]['mag'].dtype.kind=='f'                                       # Integers so far, widened when 6.5 shows up
+  assert blocks[1]['note'].dtype.kind=='U'                                      # Empty in the first block, text later
+  assert list(blocks[1]['note'])==['a','b']
+
+
+def test_csv_blocks_rejects_text_in_a_numeric_column(scope,tmp_path):
+  fname=write_csv(tmp_path/'cat.csv',['id,mag','1,5.0','2,6.0','3,bright'])
+  with pytest.raises(ValueError,match='mag'):
+    list(scope.csv_blocks(fname,rows=2))
+
+
+def test_null_scan_counts_masked_and_blank_values(scope):
+  table=Table()
+  table['name']=Column(['a','  ','b',''])
+  table['mag']=MaskedColumn([1.0,2.0,3.0,4.0],mask=[False,False,True,False])
+  table['ra']=Column([1.0,2.0,3.0,4.0])
+  table['win']=MaskedColumn(np.zeros((4,2)),mask=[[False,False],[False,False],[False,False],[False,True]])
+  counts,rows=scope.null_scan(table,chunk=3)
+  assert counts=={'name':2,'mag':1,'win':1}
+  np.testing.assert_array_equal(rows,[False,True,True,True])
+
+
+def test_sidecar_round_trip_and_stale_sidecar(scope,tmp_path):
+  fname=write_csv(tmp_path/'cat.csv',['id,mag','1,5.0','2,'])
+  table=Table.read(fname,format='ascii.csv')
+  assert scope.sidecar_store(fname,table)
+  loaded=scope.sidecar_load(fname)
+  assert loaded.colnames==['id','mag']
+  np.testing.assert_array_equal(loaded['id'],[1,2])
+  assert loaded['mag'].mask.tolist()==[False,True]
+
+  stat=os.stat(fname)
+  os.utime(fname,ns=(stat.st_atime_ns,stat.st_mtime_ns+10**9))                 # The catalog changed after the sidecar was written
+  assert scope.sidecar_load(fname) is None
+
+
+def test_sidecar_load_rejects_a_truncated_sidecar(scope,tmp_path):
+  fname=write_csv(tmp_path/'cat.csv',['id,mag','1,5.0','2,6.0'])
+  assert scope.sidecar_store(fname,Table.read(fname,format='ascii.csv'))
+  source=os.path.join(fname+scope.SIDECAR_SUFFIX,'source.npz')
+  with open(source,'r+b') as f:
+    f.truncate(os.path.getsize(source)//2)
+  assert scope.sidecar_load(fname) is None
+
+
+def test_cache_load_misses_a_damaged_entry(scope,tmp_path,monkeypatch):
+  monkeypatch.setattr(scope,'CACHE_DIR',str(tmp_path))
+  key=scope.cache_key('test',1)
+  assert scope.cache_load('windows',key) is None
+  scope.cache_store('windows',key,10**6,start=np.arange(3.0))
+  np.testing.assert_array_equal(scope.cache_load('windows',key)['start'],np.arange(3.0))
+
+  path=os.path.join(str(tmp_path),'windows',key+'.npz')
+  with open(path,'r+b') as f:
+    f.truncate(os.path.getsize(path)//2)
+  assert scope.cache_load('windows',key) is None
+
+
+def test_check_range_counts_out_of_range_and_missing_values(scope):
+  table=Table()
+  table['dec']=MaskedColumn([-95.0,0.0,90.0,np.nan,45.0],mask=[False,False,False,False,True])
+  result=scope.check_range(table,'dec',-90,90,closed=True,limit=2)
+  assert result['count']==3
+  assert result['range']=='[-90°,90°]'
+  np.testing.assert_array_equal(result['indices'],[0,3])
+
+  assert scope.check_range(table,'dec',-90,90,limit=5)['count']==4               # 90 is out of the half-open range [-90,90)